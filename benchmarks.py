@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the TeachEngineering chef, run them from the chef's directory:
+
+    ./benchmarks.py parsers https://www.teachengineering.org/lessons/view/cub_rock_lesson01 ...
+    ./benchmarks.py sections https://www.teachengineering.org/lessons/view/cub_rock_lesson01 ...
+    ./benchmarks.py strained https://www.teachengineering.org/lessons/view/cub_rock_lesson01 ...
+    ./benchmarks.py zip https://www.teachengineering.org/curricularunits/view/cub_service_unit ...
+
+The pages are saved in chefdata/pages the first time, so the next runs use the
+same documents.
+"""
+
+import argparse
+from collections import OrderedDict
+import os
+import tempfile
+import time
+from urllib.parse import urlparse
+import zipfile
+
+from ricecooker.utils import downloader, html_writer
+
+import sushichef
+from sushichef import Collection, Menu, ZipBuilder, build_path
+
+
+PAGES_DIR = os.path.join(sushichef.DATA_DIR, "pages")
+COLLECTION_TYPES = {
+    "activities": "Activities",
+    "lessons": "Lessons",
+    "curricularunits": "CurricularUnits",
+    "sprinkles": "Sprinkles",
+    "makerchallenges": "MakerChallenges",
+}
+PARSERS = ["html.parser", "lxml", "selectolax"]
+
+
+def load_page(url):
+    """
+        Returns the collection type and the document of url
+    """
+    segments = urlparse(url).path.strip("/").split("/")
+    filepath = os.path.join(build_path([PAGES_DIR]), "_".join(segments) + ".html")
+    if not os.path.exists(filepath):
+        document = downloader.read(url, loadjs=False, session=sushichef.sess)
+        with open(filepath, "wb") as f:
+            f.write(document)
+    with open(filepath, "rb") as f:
+        return COLLECTION_TYPES[segments[0].lower()], f.read()
+
+
+def load_pages(urls):
+    return [(url,) + load_page(url) for url in urls]
+
+
+def timed(fn, *args, repeat=3, clock=time.perf_counter):
+    """
+        Returns the best time of repeat calls and the result of the last call
+    """
+    best = None
+    for _ in range(repeat):
+        start = clock()
+        result = fn(*args)
+        elapsed = clock() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def render_sections(url, collection_type, document):
+    """
+        Returns the images and the html of each section of the page
+    """
+    collection = Collection(url, source_id="benchmark", type=collection_type, title="",
+                        document=document)
+    menu = Menu(collection.page, filepath="benchmark.zip", id_="CurriculumNav",
+        exclude_titles=["comments"], include_titles=[("quick", "Quick Look")],
+        index=collection.index)
+    menu.add("info", "Info")
+    rendered = OrderedDict()
+    for section in collection.drop_null_sections(menu):
+        images = section.get_imgs()
+        rendered[section.id] = (images, section.get_content())
+    return rendered
+
+
+def render_zip(url, collection_type, document, directory):
+    """
+        Returns the metadata of the page and the entries of its html5 zip
+    """
+    collection = Collection(url, source_id="benchmark", type=collection_type, title="",
+                        document=document)
+    filepath = os.path.join(directory, "benchmark.zip")
+    collection.render(filepath)
+    cr = sushichef.Copyright(collection.page, index=collection.index)
+    metadata = dict(
+        title=collection.title,
+        title_prefix=collection.title_prefix,
+        description=collection.description(),
+        copyright=cr.get_copyright_info(),
+        subjects_area=collection.get_subjects_area(),
+        pdfs=sushichef.CollectionSection(collection.page).get_pdfs())
+    with zipfile.ZipFile(filepath) as zf:
+        entries = {name: zf.read(name) for name in zf.namelist()}
+    return metadata, entries
+
+
+def parser_available(parser):
+    if parser == "lxml":
+        return sushichef.lxml is not None
+    if parser == "selectolax":
+        return sushichef.LexborHTMLParser is not None
+    return True
+
+
+def extract_page(url, collection_type, document):
+    """
+        Returns the Collection of the page with its bs4 tree built
+    """
+    collection = Collection(url, source_id="benchmark", type=collection_type, title="",
+                        document=document)
+    collection.page
+    return collection
+
+
+def benchmark_parsers(args):
+    """
+        The parse time of each backend and the time of Collection.extract once the bs4
+        tree is built (selectolax parses the document again for the extraction). The
+        sections are rendered from the bs4 tree, selectolax builds it with lxml so its
+        sections aren't compared.
+    """
+    pages = load_pages(args.urls)
+    reference = {}
+    print("{:<12} {:>14} {:>16} {:>16} {:>18}".format("parser", "parse ms/page",
+        "extract ms/page", "sections differ", "extraction differs"))
+    for parser in PARSERS:
+        if not parser_available(parser):
+            print("{:<12} not installed".format(parser))
+            continue
+
+        sushichef.HTML_PARSER = parser
+        parse_time = 0
+        extraction_time = 0
+        different = []
+        for url, collection_type, document in pages:
+            if parser == "selectolax":
+                elapsed, _ = timed(sushichef.LexborHTMLParser, document, repeat=args.repeat)
+            else:
+                elapsed, _ = timed(sushichef.parse_html, document, repeat=args.repeat)
+            parse_time += elapsed
+            collection = extract_page(url, collection_type, document)
+            elapsed, extracted = timed(collection.extract, repeat=args.repeat)
+            extraction_time += elapsed
+            rendered = None
+            if parser != "selectolax":
+                rendered = render_sections(url, collection_type, document)
+            if parser == PARSERS[0]:
+                reference[url] = (rendered, extracted)
+                continue
+            if rendered is not None and rendered != reference[url][0]:
+                different.append((url, "sections"))
+            if extracted != reference[url][1]:
+                different.append((url, "extraction"))
+
+        print("{:<12} {:>14.2f} {:>16.2f} {:>16} {:>18}".format(parser,
+            parse_time * 1000 / len(pages), extraction_time * 1000 / len(pages),
+            "-" if parser == "selectolax" else
+            len([url for url, kind in different if kind == "sections"]),
+            len([url for url, kind in different if kind == "extraction"])))
+        for url, kind in different:
+            print("    {} differs: {}".format(kind, url))
+    sushichef.HTML_PARSER = PARSERS[0]
+
+
+def benchmark_sections(args):
+    pages = load_pages(args.urls)
+    print("{:<60} {:>12} {:>12} {:>10}".format("page", "scan ms", "index ms", "same html"))
+    totals = [0, 0]
+    for url, collection_type, document in pages:
+        times = []
+        rendered = []
+        for section_index in (False, True):
+            sushichef.SECTION_INDEX = section_index
+            elapsed, result = timed(render_sections, url, collection_type, document,
+                                repeat=args.repeat, clock=time.process_time)
+            times.append(elapsed)
+            rendered.append(result)
+        totals[0] += times[0]
+        totals[1] += times[1]
+        print("{:<60} {:>12.2f} {:>12.2f} {:>10}".format(url[-60:], times[0] * 1000,
+            times[1] * 1000, str(rendered[0] == rendered[1])))
+    print("{:<60} {:>12.2f} {:>12.2f}".format("mean", totals[0] * 1000 / len(pages),
+        totals[1] * 1000 / len(pages)))
+    sushichef.SECTION_INDEX = True
+
+
+def benchmark_strained(args):
+    pages = load_pages(args.urls)
+    print("{:<60} {:>10} {:>12} {:>10} {:>10}".format("page", "full ms", "strained ms",
+        "metadata", "zip"))
+    for url, collection_type, document in pages:
+        times = []
+        rendered = []
+        for strained in (False, True):
+            elapsed, _ = timed(sushichef.parse_html, document, strained, repeat=args.repeat)
+            times.append(elapsed)
+            sushichef.STRAINED_PARSE = strained
+            with tempfile.TemporaryDirectory() as directory:
+                rendered.append(render_zip(url, collection_type, document, directory))
+        (full_metadata, full_entries), (metadata, entries) = rendered
+        print("{:<60} {:>10.2f} {:>12.2f} {:>10} {:>10}".format(url[-60:], times[0] * 1000,
+            times[1] * 1000, str(full_metadata == metadata), str(full_entries == entries)))
+        for key in full_metadata:
+            if full_metadata[key] != metadata[key]:
+                print("    metadata differs: {}".format(key))
+        for name in sorted(set(full_entries) | set(entries)):
+            if full_entries.get(name) != entries.get(name):
+                print("    zip entry differs: {}".format(name))
+    sushichef.STRAINED_PARSE = False
+
+
+def zip_entries(entries, copies):
+    """
+        Returns the entries as (filename, directory, content), the pages and the images
+        are repeated copies times to simulate larger units
+    """
+    for name, content in entries.items():
+        directory, filename = os.path.split(name)
+        if name == "index.html" or name.startswith("css/") or name.startswith("js/"):
+            yield filename, directory, content
+        else:
+            for copy in range(copies):
+                yield "{}_{}".format(copy, filename), directory, content
+
+
+def write_appending(filepath, entries):
+    with html_writer.HTMLWriter(filepath, "w") as zipper:
+        zipper.write_index_contents(entries[0][2])
+    for filename, directory, content in entries[1:]:
+        with html_writer.HTMLWriter(filepath, "a") as zipper:
+            zipper.write_contents(filename, content, directory=directory or None)
+
+
+def write_batched(filepath, entries):
+    with ZipBuilder(filepath) as zipper:
+        zipper.write_index_contents(entries[0][2])
+        for filename, directory, content in entries[1:]:
+            zipper.write_contents(filename, content, directory=directory or None)
+
+
+def benchmark_zip(args):
+    pages = load_pages(args.urls)
+    print("{:<60} {:>8} {:>14} {:>12}".format("page", "entries", "appending ms", "batched ms"))
+    for url, collection_type, document in pages:
+        with tempfile.TemporaryDirectory() as directory:
+            _, rendered = render_zip(url, collection_type, document, directory)
+            entries = sorted(zip_entries(rendered, args.copies),
+                            key=lambda entry: entry[0] != "index.html")
+            filepath = os.path.join(directory, "zip.zip")
+            appending, _ = timed(write_appending, filepath, entries, repeat=args.repeat)
+            batched, _ = timed(write_batched, filepath, entries, repeat=args.repeat)
+        print("{:<60} {:>8} {:>14.2f} {:>12.2f}".format(url[-60:], len(entries),
+            appending * 1000, batched * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TeachEngineering chef benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    parsers_parser = subparsers.add_parser("parsers",
+        help="parse time and rendered sections of each html parser backend")
+    parsers_parser.add_argument("urls", nargs="+")
+    parsers_parser.add_argument("--repeat", type=int, default=3)
+    parsers_parser.set_defaults(func=benchmark_parsers)
+
+    sections_parser = subparsers.add_parser("sections",
+        help="cpu time per page rendering the sections with and without the section index")
+    sections_parser.add_argument("urls", nargs="+")
+    sections_parser.add_argument("--repeat", type=int, default=3)
+    sections_parser.set_defaults(func=benchmark_sections)
+
+    strained_parser = subparsers.add_parser("strained",
+        help="parse time and rendered zip of the full and the strained parse")
+    strained_parser.add_argument("urls", nargs="+")
+    strained_parser.add_argument("--repeat", type=int, default=3)
+    strained_parser.set_defaults(func=benchmark_strained)
+
+    zip_parser = subparsers.add_parser("zip",
+        help="time to write the zip of each page appending the entries and with ZipBuilder")
+    zip_parser.add_argument("urls", nargs="+")
+    zip_parser.add_argument("--copies", type=int, default=1,
+        help="repeat the pages and images of the zip to simulate larger units")
+    zip_parser.add_argument("--repeat", type=int, default=3)
+    zip_parser.set_defaults(func=benchmark_zip)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
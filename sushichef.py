@@ -1,30 +1,54 @@
 #!/usr/bin/env python
 
 from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 from bs4 import Tag
-from collections import OrderedDict, defaultdict
-import copy
+import argparse
+import asyncio
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
 from http import client
 import gettext
+import hashlib
 import json
 from le_utils.constants import licenses, content_kinds, file_formats
 import logging
 import ntpath
 import os
 from pathlib import Path
+import queue
+import random
 import re
 import requests
+import shutil
+import sqlite3
+import zlib
 from ricecooker.classes.licenses import get_license
 from ricecooker.chefs import JsonTreeChef
 from ricecooker.utils.caching import CacheForeverHeuristic, FileCache, CacheControlAdapter
+from cachecontrol.cache import BaseCache
 from ricecooker.utils import downloader, html_writer
 from ricecooker.utils.jsontrees import write_tree_to_json_tree, SUBTITLES_FILE
 import sys
+import tempfile
+import threading
 import time
 from urllib.error import URLError
-from urllib.parse import urljoin
+from urllib.parse import parse_qs, urljoin, urlparse
+import urllib3
 import youtube_dl
 
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
 
 # Additional Constants
 ################################################################################
@@ -43,14 +67,53 @@ DOWNLOAD_VIDEOS = True
 # time.sleep for debugging proporses, it helps to check log messages
 TIME_SLEEP = .1
 
+# html.parser, lxml or selectolax. selectolax is only used for read-only extractions
+# (Collection.extract), the trees used by the sections are built with lxml
+HTML_PARSER = "html.parser"
+
+# If True only the regions read by the chef are parsed on the collection pages
+STRAINED_PARSE = False
+
+# If False the sections search the whole page instead of using the section index
+# for benchmarking proporses
+SECTION_INDEX = True
+
 DATA_DIR = "chefdata"
+# the azure search settings are cached for a week
+SEARCH_SETTINGS_CACHE = os.path.join(DATA_DIR, "azure_search_settings.json")
+SEARCH_SETTINGS_TTL = 7 * 24 * 60 * 60
 GENERAL_COPYRIGHT_HOLDER = "TeachEngineering digital library  © 2013 by Regents of the University of Colorado; original © 2013 Board of Regents, University of Nebraska"
 #Curricular units with its lessons
 CURRICULAR_UNITS_MAP = defaultdict(OrderedDict)
-#Lessons related with curricular units
-LESSONS_CURRICULAR_MAP = defaultdict(set)
+#Trees built when lang=all
+LANGUAGES = ["en", "es"]
+#Data extracted from the collection pages, a record is reused while the page body
+#and EXTRACTION_VERSION don't change. Increase it when the extraction or the
+#rendering of the sections change
+EXTRACTION_VERSION = 1
+EXTRACTIONS_DB = os.path.join(DATA_DIR, "extractions.sqlite3")
+EXTRACTIONS = None
+#Images and pdfs stored by content hash, shared between collections and languages
+ASSETS_DIR = os.path.join(DATA_DIR, "assets")
+ASSETS_CHUNK_SIZE = 64 * 1024
+#Expanded short links, they are resolved again after a month
+SHORT_URLS_CACHE = os.path.join(DATA_DIR, "short_urls.json")
+SHORT_URLS_TTL = 30 * 24 * 60 * 60
+#The videos are downloaded once per youtube id to VIDEOS_DIR, in background, their
+#nodes are placeholders until the tree is finished
+VIDEOS_DIR = os.path.join(DATA_DIR, "videos")
+VIDEO_PLACEHOLDER = "VideoPlaceholder"
+#Title, formats, subtitles and file of the downloaded videos by youtube id
+VIDEOS_INFO_CACHE = os.path.join(DATA_DIR, "videos_info.json")
+VIDEOS_INFO = None
 # webcache
 ###############################################################
+# webcache=sqlite keeps the responses in a single SQLite file
+WEBCACHE_DB = ".webcache.sqlite3"
+# archive=record saves every http response of the run, archive=replay serves them
+# without network
+ARCHIVE_PATH = os.path.join(DATA_DIR, "archive")
+ARCHIVE = None
 sess = requests.Session()
 cache = FileCache('.webcache')
 basic_adapter = CacheControlAdapter(cache=cache)
@@ -67,7 +130,7 @@ def test():
     """
     url = "https://www.teachengineering.org/curricularunits/view/cub_service_unit"
     collection_type = "CurricularUnits"
-    channel_tree = dict(
+    channel_tree = ChannelTree(
         source_domain="teachengineering.org",
         source_id='teachengineering',
         title='TeachEngineering',
@@ -86,6 +149,7 @@ def test():
             type=collection_type,
             lang="en")
         collection.to_file(channel_tree)
+        VIDEOS.finalize(channel_tree)
     except requests.exceptions.HTTPError as e:
         LOGGER.info("Error: {}".format(e))
 
@@ -96,28 +160,86 @@ def check_subtitles(page):
     urls = c.get_videos_urls()
     for url in urls:
         video = YouTubeResource(url)
-        info = video.get_video_info()
-        if isinstance(info, dict) and len(info.keys()) > 0:
+        languages = video.subtitles_languages()
+        if languages is not None:
             with open("/tmp/subtitles.csv", 'a') as csv_file:
                 csv_writer = csv.writer(csv_file, delimiter=",")
-                csv_writer.writerow([url] + list(info["subtitles"].keys()))
+                csv_writer.writerow([url] + languages)
+
+
+class SearchSettingsError(Exception):
+    pass
 
 
 class ResourceBrowser(object):
-    def __init__(self, resource_url):
+    # only the fields stored in web_resource_tree_{lang}.json
+    SELECT_FIELDS = ["id", "collection", "spanishVersionId", "title", "summary",
+                    "gradeTarget", "gradeRange"]
+
+    SETTINGS_KEYS = ["serviceName", "indexName", "apiKey", "apiVersion"]
+    SETTINGS_RE = re.compile(r"""["']?(serviceName|indexName|apiKey|apiVersion)["']?\s*:\s*["']([^"']+)["']""")
+
+    def __init__(self, resource_url, settings_ttl=SEARCH_SETTINGS_TTL):
         self.resource_url = resource_url
+        self.settings_cache = JsonStore(SEARCH_SETTINGS_CACHE, ttl=settings_ttl)
+
+    def get_resource_data(self, loadjs=False):
+        """
+            Returns the azure search settings. They are read from the cache, if they
+            are not there (or expired) the page is fetched without javascript and the
+            settings are extracted with a regex. The javascript render is only used
+            if loadjs is True or the regex doesn't find all the settings.
+        """
+        if loadjs is False:
+            cached = self.settings_cache.get(self.resource_url)
+            #an incomplete entry (stored by an older version) is a miss
+            if cached is not None and self.complete_settings(cached["settings"]):
+                LOGGER.info("Azure search settings from cache (extracted with {} in {:.2f}s)".format(
+                    cached["source"], cached["elapsed"]))
+                return cached["settings"]
+            start = time.time()
+            azureSearchSettings = self.get_settings_regex()
+            source = "regex"
+        else:
+            azureSearchSettings = {}
+
+        if not self.complete_settings(azureSearchSettings):
+            start = time.time()
+            azureSearchSettings = self.get_settings_loadjs()
+            source = "loadjs"
+        elapsed = time.time() - start
+        LOGGER.info("Azure search settings extracted with {} in {:.2f}s".format(source, elapsed))
+        if self.complete_settings(azureSearchSettings):
+            self.settings_cache.set(self.resource_url, 
+                dict(settings=azureSearchSettings, source=source, elapsed=elapsed))
+            self.settings_cache.save()
+        else:
+            LOGGER.info("The azure search settings are incomplete, they are not cached: {}".format(
+                sorted(azureSearchSettings.keys())))
+        return azureSearchSettings
+
+    @staticmethod
+    def complete_settings(azureSearchSettings):
+        return all(key in azureSearchSettings for key in ResourceBrowser.SETTINGS_KEYS)
+
+    def get_settings_regex(self):
+        try:
+            page_contents = downloader.read(self.resource_url, loadjs=False, session=sess)
+        except requests.exceptions.HTTPError as e:
+            LOGGER.info("Error: {}".format(e))
+            return {}
+        if isinstance(page_contents, bytes):
+            page_contents = page_contents.decode("utf-8", "ignore")
+        return dict(ResourceBrowser.SETTINGS_RE.findall(page_contents))
 
-    def get_resource_data(self):
+    def get_settings_loadjs(self):
         try:
             page_contents = downloader.read(self.resource_url, loadjs=True)
         except requests.exceptions.HTTPError as e:
             LOGGER.info("Error: {}".format(e))
-        page = BeautifulSoup(page_contents, 'html.parser')
-        scripts = page.find_all("script")
-        keys = ["serviceName", "indexName", "apiKey", "apiVersion"]
+            return {}
         azureSearchSettings = {}
-        for scriptjs in scripts:
-            textValue = scriptjs.text
+        for textValue in get_scripts_text(page_contents):
             try:
                 for elem in textValue.split('{', 1)[1].rsplit('}', 1):
                     for kv in elem.split(","):
@@ -125,7 +247,7 @@ class ResourceBrowser(object):
                             k, v = kv.split(":")
                             k = k.strip().replace('"', "").replace("'", "")
                             v = v.strip().replace('"', "").replace("'", "")
-                            if k in keys:
+                            if k in ResourceBrowser.SETTINGS_KEYS:
                                 azureSearchSettings[k] = v
                         except ValueError:
                             pass
@@ -133,44 +255,78 @@ class ResourceBrowser(object):
                 pass
         return azureSearchSettings
 
-    def json_browser_url(self, azureSearchSettings, offset=0, batch=10):
-        return "https://{serviceName}.search.windows.net/indexes/{indexName}/docs?api-version={apiVersion}&api-key={apiKey}&search=&%24count=true&%24top={batch}&%24skip={offset}&searchMode=all&scoringProfile=FieldBoost&%24orderby=sortableTitle".format(batch=batch, offset=offset, **azureSearchSettings)
-
-    def run(self):
-        settings = self.get_resource_data()
-        offset = 0
-        batch = 10
+    def json_browser_url(self, azureSearchSettings, offset=0, batch=10, select=None):
+        url = "https://{serviceName}.search.windows.net/indexes/{indexName}/docs?api-version={apiVersion}&api-key={apiKey}&search=&%24count=true&%24top={batch}&%24skip={offset}&searchMode=all&scoringProfile=FieldBoost&%24orderby=sortableTitle".format(batch=batch, offset=offset, **azureSearchSettings)
+        if select is not None:
+            url += "&%24select=" + ",".join(select)
+        return url
+
+    def get_page(self, session, settings, offset, batch, tries=None):
+        """
+            Returns the page at offset, a 403 or a bad formed json object is retried
+            (forever if tries is None) and SearchSettingsError is raised when there are
+            no more tries or the settings are incomplete.
+        """
+        if not self.complete_settings(settings):
+            raise SearchSettingsError("Incomplete azure search settings: {}".format(
+                sorted(settings.keys())))
+        num_tries = 0
         while True:
-            url = self.json_browser_url(settings, offset=offset, batch=batch)
-            req = requests.get(url)
-            data = req.json()
+            url = self.json_browser_url(settings, offset=offset, batch=batch,
+                select=ResourceBrowser.SELECT_FIELDS)
+            req = session.get(url)
             try:
-                num_registers = data["@odata.count"]
-                #num_registers = 4
-            except KeyError:
-                LOGGER.info("The json object is bad formed: {}".format(data))
-                LOGGER.info("retry...")
-                time.sleep(3)
-            else:
-                queue = data["value"]
+                data = req.json()
+            except ValueError:
+                data = {}
+            if req.status_code != 403 and "@odata.count" in data:
                 LOGGER.info("CRAWLING : OFFSET {}".format(offset))
-                while len(queue) > 0:
-                    resource = queue.pop(0)
-                    url = self.build_resource_url(resource["id"], resource["collection"])
-                    if resource["spanishVersionId"] is not None:
-                        url_es = self.build_resource_url(resource["spanishVersionId"], resource["collection"])
-                    else:
-                        url_es = None
-                    yield dict(url=url, collection=resource["collection"],
-                        url_es=url_es,
-                        spanishVersionId=resource["spanishVersionId"],
-                        title=resource["title"], summary=resource["summary"],
-                        grade_target=resource["gradeTarget"],
-                        grade_range=resource["gradeRange"],
-                        id=resource["id"])
-                offset += batch
-                if offset > num_registers:
-                    break
+                return data
+            LOGGER.info("The json object is bad formed ({}): {}".format(req.status_code, data))
+            num_tries += 1
+            if tries is not None and num_tries >= tries:
+                raise SearchSettingsError("Azure search settings rejected at offset {}".format(offset))
+            LOGGER.info("retry...")
+            SCHEDULER.backoff(url, num_tries)
+
+    def run(self, page_size=10, concurrency=1):
+        """
+            The first page gives the total of registers (@odata.count), the remaining
+            $skip windows are requested concurrently and yielded in sortableTitle order.
+        """
+        session = TRANSPORT.session()
+        settings = self.get_resource_data()
+        try:
+            data = self.get_page(session, settings, 0, page_size, tries=1)
+        except SearchSettingsError:
+            LOGGER.info("The azure search settings don't work, rendering the page with javascript")
+            settings = self.get_resource_data(loadjs=True)
+            data = self.get_page(session, settings, 0, page_size)
+        num_registers = data["@odata.count"]
+        for resource in data["value"]:
+            yield self.resource_info(resource)
+
+        offsets = range(page_size, num_registers + 1, page_size)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pages = executor.map(lambda offset: self.get_page(session, settings, offset, page_size),
+                                offsets)
+            for data in pages:
+                for resource in data["value"]:
+                    yield self.resource_info(resource)
+
+    def resource_info(self, resource):
+        url = self.build_resource_url(resource["id"], resource["collection"])
+        if resource["spanishVersionId"] is not None:
+            url_es = self.build_resource_url(resource["spanishVersionId"], resource["collection"])
+        else:
+            url_es = None
+        return dict(url=url, collection=resource["collection"],
+            url_es=url_es,
+            spanishVersionId=resource["spanishVersionId"],
+            title=resource["title"], summary=resource["summary"],
+            grade_target=resource["gradeTarget"],
+            grade_range=resource["gradeRange"],
+            id=resource["id"])
 
     def build_resource_url(self, id_name, collection):
         return urljoin(BASE_URL, collection.lower()+"/view/"+id_name)
@@ -181,9 +337,9 @@ class Menu(object):
         This class checks elements on the lesson menu and build the menu list
     """
     def __init__(self, page, filepath=None, id_=None, exclude_titles=None, 
-                include_titles=None, lang="en"):
+                include_titles=None, lang="en", index=None):
         if page:
-            self.body = page.find("div", id=id_)
+            self.body = find_div(page, id_=id_, index=index)
         else:
             self.body = None
         self.menu = OrderedDict()
@@ -197,22 +353,21 @@ class Menu(object):
         if self.body:
             self.menu_titles(self.body.find_all("li"))
 
-    def write(self, content):
-        with html_writer.HTMLWriter(self.filepath, "w") as zipper:
-            zipper.write_index_contents(content)
+    def write(self, zipper, content):
+        zipper.write_index_contents(content)
 
-    def write_css_js(self, filepath):
-        with html_writer.HTMLWriter(filepath, "a") as zipper, open("chefdata/styles.css") as f:
+    def write_css_js(self, zipper):
+        with open("chefdata/styles.css") as f:
             content = f.read()
             zipper.write_contents("styles.css", content, directory="css/")
 
-        with html_writer.HTMLWriter(filepath, "a") as zipper, open("chefdata/scripts.js") as f:
+        with open("chefdata/scripts.js") as f:
             content = f.read()
             zipper.write_contents("scripts.js", content, directory="js/")
 
-    def to_file(self):
-        self.write('<html><head><meta charset="utf-8"><link rel="stylesheet" href="css/styles.css"></head><body><div class="main-content-with-sidebar">'+self.to_html()+'</div><script src="js/scripts.js"></script></body></html>')
-        self.write_css_js(self.filepath)
+    def to_file(self, zipper):
+        self.write(zipper, '<html><head><meta charset="utf-8"><link rel="stylesheet" href="css/styles.css"></head><body><div class="main-content-with-sidebar">'+self.to_html()+'</div><script src="js/scripts.js"></script></body></html>')
+        self.write_css_js(zipper)
 
     def menu_titles(self, titles):
         for title in titles:
@@ -278,19 +433,19 @@ class Menu(object):
 
 
 class CurriculumType(object):
-     def render(self, page, menu_filename, lang="en", resource_url=None):
+     def render(self, page, menu_filename, lang="en", resource_url=None, index=None):
         for meta_section in self.sections:
             Section = meta_section["class"]
             if isinstance(Section, list):
                 section = sum([subsection(page, filename=menu_filename, 
                                 menu_name=meta_section["menu_name"], lang=lang,
-                                resource_url=resource_url)
+                                resource_url=resource_url, index=index)
                                 for subsection in Section])
                 section.id = meta_section["id"] 
             else:
                 section = Section(page, filename=menu_filename, id_=meta_section["id"], 
                                 menu_name=meta_section["menu_name"], lang=lang,
-                                resource_url=resource_url)
+                                resource_url=resource_url, index=index)
             yield section
 
 
@@ -401,13 +556,15 @@ class MakerChallenge(CurriculumType):
 
 
 class Collection(object):
-    def __init__(self, url, source_id, type, title, lang="en", subjects_area=None):
-        self.page = self.download_page(url)
-        if self.page is not False:
-            self.title_prefix = self.clean_title(self.page.find("span", class_="title-prefix"))
-            self.title = self.clean_title(self.page.find("span", class_="curriculum-title"))
-            if self.title is None:
-                self.title = title
+    def __init__(self, url, source_id, type, title, lang="en", subjects_area=None,
+                document=None):
+        if document is None:
+            document = self.download_document(url)
+        self.document = document
+        self._page = None
+        self._index = None
+        self.extraction = None
+        if self.document is not False:
             self.contribution_by = None
             self.source_id = source_id
             self.resource_url = url.strip()
@@ -415,6 +572,7 @@ class Collection(object):
             self.license = None
             self.lang = lang
             self.subjects_area = subjects_area
+            self.curriculum_type = None
             
             if self.type == "MakerChallenges":
                 self.curriculum_type = MakerChallenge()
@@ -427,25 +585,40 @@ class Collection(object):
             elif self.type == "Sprinkles":
                 self.curriculum_type = Sprinkle()
 
-    def download_page(self, url):
-        tries = 0
-        while tries < 4:
-            try:
-                document = downloader.read(url, loadjs=False, session=sess)
-            except requests.exceptions.HTTPError as e:
-                LOGGER.info("Error: {}".format(e))
-            except requests.exceptions.ConnectionError:
-                ### this is a weird error, may be it's raised when teachengineering's webpage
-                ### is slow to respond requested resources
-                LOGGER.info("Connection error, the resource will be scraped in 5s...")
-                time.sleep(3)
+            #with an extraction record the page is not parsed
+            if self.curriculum_type is not None and EXTRACTIONS is not None:
+                self.extraction = EXTRACTIONS.get(self.resource_url, self.document)
+            if self.extraction is not None:
+                self.title_prefix = self.extraction["title_prefix"]
+                self.title = self.extraction["title"]
             else:
-                return BeautifulSoup(document, 'html.parser') #html5lib
-            tries += 1
-        return False
+                self.title_prefix = self.clean_title(self.page.find("span", class_="title-prefix"))
+                self.title = self.clean_title(self.page.find("span", class_="curriculum-title"))
+            if self.title is None:
+                self.title = title
+
+    @property
+    def page(self):
+        if self._page is None:
+            if self.document is False:
+                self._page = False
+            else:
+                self._page = parse_html(self.document, strained=STRAINED_PARSE)
+        return self._page
+
+    @property
+    def index(self):
+        if self._index is None and SECTION_INDEX and self.page is not False:
+            self._index = SectionIndex(self.page)
+        return self._index
+
+    def download_document(self, url):
+        return download_document(url)
 
 
     def description(self):
+        if self.extraction is not None:
+            return self.extraction["description"]
         descr = self.page.find("meta", property="og:description")
         return descr.get("content", "")
 
@@ -458,7 +631,8 @@ class Collection(object):
         sections = []
         for section in self.curriculum_type.render(self.page, menu.filepath, 
                                                     lang=self.lang, 
-                                                    resource_url=self.resource_url):
+                                                    resource_url=self.resource_url,
+                                                    index=self.index):
             if section.body is None:
                 menu.remove(section.id)
             else:
@@ -488,17 +662,6 @@ class Collection(object):
                 children=[]
             )
 
-    def empty_info(self, url):
-        return dict(
-                kind=content_kinds.TOPIC,
-                source_id=url,
-                title="TMP",
-                thumbnail=None,
-                description="",
-                license=get_license(licenses.CC_BY, copyright_holder="X").as_dict(),
-                children=[]
-            )
-
     def get_thumbnail(self, sections):
         thumbnail_img = None
         for section in sections:
@@ -512,97 +675,344 @@ class Collection(object):
 
     def get_subjects_area(self):
         if self.subjects_area is None:
-            copy_page = copy.copy(self.page)
-            ql = QuickLook(copy_page)
-            return ql.get_subject_area()
+            return self.extract()["subjects_area"]
         else:
             return self.subjects_area
 
-    def to_file(self, channel_tree):
-        LOGGER.info(" + [{}]: {}".format(self.curriculum_type.name, self.title))
-        LOGGER.info("   - URL: {}".format(self.resource_url))
-        copy_page = copy.copy(self.page)
-        cr = Copyright(copy_page)
-        self.license = get_license(licenses.CC_BY, copyright_holder=cr.get_copyright_info()).as_dict()
-        subjects_area = self.get_subjects_area()
-        base_path = build_path([DATA_DIR, self.type, self.source_id])
-        filepath = "{path}/{source_id}.zip".format(path=base_path, 
-            source_id=self.source_id)
+    def extract(self):
+        """
+            Returns the data read from the pristine page, it must be called before
+            the sections are rendered. With the selectolax parser it's read from the
+            document, the bs4 tree is only used by the sections.
+        """
+        if self.extraction is not None:
+            return self.extraction
+        if use_selectolax():
+            return dict(extract_document(self.document, strained=STRAINED_PARSE),
+                title=self.title, title_prefix=self.title_prefix)
+        quick_look = find_div(self.page, class_="quick-look", index=self.index)
+        all_sections = CollectionSection(self.page)
+        return dict(
+            title=self.title,
+            title_prefix=self.title_prefix,
+            description=self.description(),
+            copyright=Copyright(self.page, index=self.index).get_copyright_info(),
+            subjects_area=QuickLook.subject_area_links(quick_look),
+            pdfs=list(all_sections.get_pdfs()),
+            videos_urls=sorted(all_sections.get_videos_urls()))
+
+    def save_extraction(self, extracted, menu, sections):
+        """
+            Stores the extracted data with the menu and the rendered sections,
+            the next runs write the zip from it
+        """
+        if EXTRACTIONS is None or self.extraction is not None:
+            return
+        record = dict(extracted,
+            menu=list(menu.menu.items()),
+            sections=[section.extraction() for section in sections])
+        EXTRACTIONS.set(self.resource_url, self.document, record)
+
+    def render(self, filepath):
+        """
+            Writes the html5 zip of the collection, returns the menu and the sections
+        """
+        if self.extraction is not None:
+            return self.render_extraction(filepath)
+
         menu = Menu(self.page, filepath=filepath, id_="CurriculumNav", 
             exclude_titles=["comments"], #attachments
             include_titles=[("quick", "Quick Look")],
-            lang=self.lang)
+            lang=self.lang, index=self.index)
         menu.add("info", "Info")
 
         sections = self.drop_null_sections(menu)
-        #build the menu index
-        menu.to_file()
-        #set section's html files to the menu
-        for section in sections:
-            menu_filename = menu.set_section(section)
-            menu_index = menu.to_html(directory="", active_li=menu_filename)
-            section.to_file(menu_filename, menu_index=menu_index)
+        with ZipBuilder(filepath) as zipper:
+            #build the menu index
+            menu.to_file(zipper)
+            #set section's html files to the menu
+            for section in sections:
+                menu_filename = menu.set_section(section)
+                menu_index = menu.to_html(directory="", active_li=menu_filename)
+                section.to_file(menu_filename, zipper, menu_index=menu_index)
 
         menu.check()
-        menu.license = self.license
+        return menu, sections
+
+    def render_extraction(self, filepath):
+        """
+            Writes the html5 zip from the sections rendered in a previous run
+        """
+        menu = Menu(None, filepath=filepath, lang=self.lang)
+        menu.menu = OrderedDict((title_id, dict(values))
+                                for title_id, values in self.extraction["menu"])
+        sections = [ExtractedSection(filepath, **section)
+                    for section in self.extraction["sections"]]
+        with ZipBuilder(filepath) as zipper:
+            menu.to_file(zipper)
+            for section in sections:
+                section.to_file(section.menu_filename, zipper)
+        menu.check()
+        return menu, sections
+
+    def scrape(self):
+        """
+            Renders the collection's files and returns a self-contained result with
+            the nodes and links needed to attach it to the channel tree.
+        """
+        LOGGER.info(" + [{}]: {}".format(self.curriculum_type.name, self.title))
+        LOGGER.info("   - URL: {}".format(self.resource_url))
+        #the license, subject areas, pdfs and videos are read from the pristine page,
+        #the sections are modified when they are rendered
+        extracted = self.extract()
+        self.license = get_license(licenses.CC_BY, copyright_holder=extracted["copyright"]).as_dict()
+        subjects_area = self.subjects_area
+        if subjects_area is None:
+            subjects_area = extracted["subjects_area"]
+        base_path = build_path([DATA_DIR, self.type, self.source_id])
+        filepath = "{path}/{source_id}.zip".format(path=base_path, 
+            source_id=self.source_id)
 
         #check for pdfs and videos on all page
-        all_sections = CollectionSection(copy_page, resource_url=self.resource_url, lang=self.lang)
-        pdfs_info = all_sections.build_pdfs_info(base_path, self.license)
-        videos_info = all_sections.build_videos_info(base_path, self.license)
-
-        for subject_area in subjects_area:
-            subject_area_topic_node = get_level_map(channel_tree, [subject_area])
-            if subject_area_topic_node is None:
-                subject_area_topic_node = dict(
-                    kind=content_kinds.TOPIC,
-                    source_id=subject_area,
-                    title=_(subject_area),
-                    description="",
-                    license=self.license,
-                    children=[]
-                )
-                channel_tree["children"].append(subject_area_topic_node)
-
-            topic_node = get_level_map(channel_tree, [subject_area, self.type])
-            thumbnail_img = self.get_thumbnail(sections)
-            curriculum_info = self.info(thumbnail_img) #curricular name
-            description = self.description()
-            curriculum_info["children"].append(menu.info(thumbnail_img, self.title, description))
-            if pdfs_info is not None:
-                curriculum_info["children"] += pdfs_info
-            if videos_info is not None:
-                curriculum_info["children"] += videos_info
-            if topic_node is None:
-                topic_node = self.topic_info() #topic name
-                subject_area_topic_node["children"].append(topic_node)
-
-            topic_node["children"].append(curriculum_info)
-            if self.type == "CurricularUnits":       
-                #build a template for the curriculums
-                for url, index in CURRICULAR_UNITS_MAP[self.resource_url].items():
-                    #search for lessons
-                    node = get_node_from_channel(url, channel_tree, exclude="CurricularUnits")
-                    if node is None:
-                        curriculum_info["children"].append(self.empty_info(url))
-                    else:
-                        curriculum_info["children"].append(node)
-        
-        if self.type != "CurricularUnits":
-            curriculars_unit_url = LESSONS_CURRICULAR_MAP.get(self.resource_url, [])
-            for curricular_unit_url in curriculars_unit_url:
-                #search for curricular units
-                curricular_nodes = get_multiple_node_from_channel(curricular_unit_url, 
-                    channel_tree, max_level=2)
-                if curricular_nodes:
-                    for curricular_node in curricular_nodes:
-                        for i, children in enumerate(curricular_node["children"]):
-                            if children["source_id"] == self.resource_url:
-                                curricular_node["children"][i] = curriculum_info
-                                break
+        all_sections = CollectionSection(None, resource_url=self.resource_url, lang=self.lang)
+        pdfs_info = all_sections.build_pdfs_info(base_path, self.license,
+                                                pdfs_urls=extracted["pdfs"])
+        videos_info = all_sections.build_videos_info(self.license,
+                                                videos_urls=extracted["videos_urls"])
+
+        menu, sections = self.render(filepath)
+        menu.license = self.license
+        self.save_extraction(extracted, menu, sections)
+
+        thumbnail_img = self.get_thumbnail(sections)
+        description = extracted["description"]
+        children = [menu.info(thumbnail_img, self.title, description)]
+        if pdfs_info is not None:
+            children += pdfs_info
+        if videos_info is not None:
+            children += videos_info
+        schedule = []
+        for section in sections:
+            schedule.extend(getattr(section, "schedule", []))
+        return dict(
+            resource_url=self.resource_url,
+            type=self.type,
+            license=self.license,
+            subjects_area=subjects_area,
+            topic_info=self.topic_info(), #topic name
+            info=self.info(thumbnail_img), #curricular name
+            children=children,
+            schedule=schedule)
+
+    def to_file(self, channel_tree):
+        attach_collection(channel_tree, self.scrape())
+
+
+def download_document(url):
+    """
+        Returns the page at url, False if it can't be downloaded
+    """
+    #the connection errors and the 5xx responses are retried by SCHEDULER
+    try:
+        return downloader.read(url, loadjs=False, session=sess)
+    except requests.exceptions.HTTPError as e:
+        LOGGER.info("Error: {}".format(e))
+    except requests.exceptions.ConnectionError as e:
+        LOGGER.info("Connection error, the resource is skipped: {}".format(e))
+    return False
+
+
+def scrape_collection(url, source_id, type, title, lang="en", subjects_area=None,
+                    document=None):
+    collection = Collection(url, source_id=source_id, type=type, title=title, 
+                        lang=lang, subjects_area=subjects_area, document=document)
+    if collection.document is False:
+        LOGGER.info("The resource can't be downloaded: {}".format(url))
+        return
+    return collection.scrape()
+
+
+def attach_collection(channel_tree, result):
+    """
+        Attaches the result of Collection.scrape to the channel tree, the
+        curricular units' lessons are attached later by resolve_curricular_units.
+    """
+    resource_url = result["resource_url"]
+    collection_type = result["type"]
+    for lesson_url in result["schedule"]:
+        if lesson_url not in CURRICULAR_UNITS_MAP[resource_url]:
+            CURRICULAR_UNITS_MAP[resource_url][lesson_url] = len(CURRICULAR_UNITS_MAP[resource_url])
+
+    for subject_area in result["subjects_area"]:
+        subject_area_topic_node = get_level_map(channel_tree, [subject_area])
+        if subject_area_topic_node is None:
+            subject_area_topic_node = dict(
+                kind=content_kinds.TOPIC,
+                source_id=subject_area,
+                title=_(subject_area),
+                description="",
+                license=result["license"],
+                children=[]
+            )
+            channel_tree.add_child(channel_tree, subject_area_topic_node)
+
+        topic_node = get_level_map(channel_tree, [subject_area, collection_type])
+        curriculum_info = dict(result["info"], children=list(result["children"]))
+        if topic_node is None:
+            topic_node = dict(result["topic_info"], children=[])
+            channel_tree.add_child(subject_area_topic_node, topic_node)
+
+        channel_tree.add_child(topic_node, curriculum_info)
+
+
+def resolve_curricular_units(channel_tree):
+    """
+        Attaches the lessons and activities to their curricular units in schedule
+        order. It runs once, after all the collections are attached to the tree,
+        and returns the (unit, lesson) links that couldn't be resolved.
+    """
+    unresolved = []
+    for unit_url, lessons in CURRICULAR_UNITS_MAP.items():
+        unit_nodes = get_multiple_node_from_channel(unit_url, channel_tree, max_level=2)
+        if len(unit_nodes) == 0:
+            continue
+        for lesson_url in lessons:
+            node = get_node_from_channel(lesson_url, channel_tree, exclude="CurricularUnits")
+            if node is None:
+                unresolved.append((unit_url, lesson_url))
+                continue
+            for unit_node in unit_nodes:
+                channel_tree.add_child(unit_node, node)
+
+    for unit_url, lesson_url in unresolved:
+        LOGGER.info("Unresolved link of the curricular unit {}: {}".format(unit_url, lesson_url))
+    LOGGER.info("Curricular units links unresolved: {}".format(len(unresolved)))
+    return unresolved
+
+
+class PageFetcher(object):
+    """
+        Fetches pages from an asyncio loop running in its own thread. The requests go
+        through the shared session (and its .webcache storage) and at most per_host
+        requests are in flight for each host, the scheduler can allow less.
+    """
+    def __init__(self, per_host=4):
+        self.per_host = per_host
+        self.semaphores = {}
+        self.executor = ThreadPoolExecutor(max_workers=per_host * 2)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, url):
+        return asyncio.run_coroutine_threadsafe(self.fetch(url), self.loop)
+
+    async def fetch(self, url):
+        host = urlparse(url).netloc
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.per_host)
+        async with self.semaphores[host]:
+            #the connection errors and the 5xx responses are retried by SCHEDULER
+            try:
+                return await self.loop.run_in_executor(self.executor, 
+                    functools.partial(downloader.read, url, loadjs=False, session=sess))
+            except requests.exceptions.HTTPError as e:
+                LOGGER.info("Error: {}".format(e))
+            except requests.exceptions.ConnectionError as e:
+                LOGGER.info("Connection error, the resource is skipped: {}".format(e))
+        #False is a failed fetch, the page is not requested again
+        return False
+
+    def prefetch(self, resources, keys, window=10):
+        """
+            Yields (resource, {key: future}) with the pages of up to window
+            resources requested ahead of the consumer.
+        """
+        pending = deque()
+        for resource in resources:
+            pending.append((resource, {key: self.submit(resource[key]) for key in keys}))
+            if len(pending) > window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown()
+
+
+def prefetched(documents, key):
+    if key in documents:
+        return documents[key].result()
+
+
+def ordered_map(fn, items, workers=1):
+    """
+        Like map, but fn is called from a pool of threads. The results are
+        yielded in the order of items and at most workers*2 items are in flight.
+    """
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(fn, item))
+            if len(futures) >= workers * 2:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+class ChannelTree(dict):
+    """
+        The channel tree with a live index of its nodes by source_id and of its
+        (subject area, collection type) topics. The nodes must be inserted with
+        add_child to be indexed.
+    """
+    def __init__(self, **kwargs):
+        super(ChannelTree, self).__init__(**kwargs)
+        #source_id -> [(depth, ancestors titles, parent, node)]
+        self.nodes = defaultdict(list)
+        #(subject area,) and (subject area, type) -> node
+        self.levels = {}
+        #id(node) -> (depth, ancestors titles)
+        self.positions = {id(self): (0, ())}
+        for node in self["children"]:
+            self.index(self, node, 1, ())
+
+    def add_child(self, parent, node):
+        parent["children"].append(node)
+        depth, titles = self.positions[id(parent)]
+        self.index(parent, node, depth + 1, titles)
+
+    def index(self, parent, node, depth, titles):
+        self.nodes[node["source_id"]].append((depth, titles, parent, node))
+        if depth == 1:
+            self.levels.setdefault((node["source_id"],), node)
+        elif depth == 2:
+            self.levels.setdefault((parent["source_id"], node["source_id"]), node)
+        if "children" in node:
+            children_titles = titles + (node["title"],)
+            self.positions.setdefault(id(node), (depth, children_titles))
+            for child in node["children"]:
+                self.index(node, child, depth + 1, children_titles)
+
+    def get_nodes(self, source_id, exclude=None, max_depth=None):
+        """
+            Returns the nodes in the same order of a breadth first search
+        """
+        entries = [entry for entry in self.nodes.get(source_id, []) 
+                if exclude not in entry[1] and (max_depth is None or entry[0] <= max_depth)]
+        return [entry[3] for entry in sorted(entries, key=lambda entry: entry[0])]
 
 
 def get_level_map(tree, levels):
+    if isinstance(tree, ChannelTree):
+        return tree.levels.get(tuple(levels))
     actual_node = levels[0]
     r_levels = levels[1:]
     for children in tree["children"]:
@@ -614,6 +1024,9 @@ def get_level_map(tree, levels):
 
 
 def get_node_from_channel(source_id, channel_tree, exclude=None):
+    if isinstance(channel_tree, ChannelTree):
+        nodes = channel_tree.get_nodes(source_id, exclude=exclude)
+        return nodes[0] if len(nodes) > 0 else None
     parent = channel_tree["children"]
     while len(parent) > 0:
         for children in parent:
@@ -630,6 +1043,8 @@ def get_node_from_channel(source_id, channel_tree, exclude=None):
 
 
 def get_multiple_node_from_channel(source_id, channel_tree, exclude=None, max_level=0):
+    if isinstance(channel_tree, ChannelTree):
+        return channel_tree.get_nodes(source_id, exclude=exclude, max_depth=max_level + 1)
     parent = channel_tree["children"]
     results = []
     level = 1
@@ -650,13 +1065,50 @@ def get_multiple_node_from_channel(source_id, channel_tree, exclude=None, max_le
     return results
 
 
+PDF_LINK_RE = re.compile(r"^\/content|https\:\/\/www.teachengineering")
+
+
+def collect_pdfs(links):
+    """
+        Returns the (filename, name, url) of the pdfs in links, (href, text) pairs
+    """
+    urls = {}
+    for href, text in links:
+        if href.endswith(".pdf") and href not in urls:
+            filename = get_name_from_url(href)
+            name = text.replace("(pdf)", "").strip()
+            urls[href] = (filename, name, urljoin(BASE_URL, href))
+    return urls.values()
+
+
+def collect_videos_urls(iframes_srcs, links):
+    """
+        Returns the youtube urls of the iframes and the links (http hrefs)
+    """
+    urls = set([])
+    for url in iframes_srcs:
+        if YouTubeResource.is_youtube(url):
+            urls.add(YouTubeResource.transform_embed(url))
+
+    ### some links who are youtube resources have shorted thier ulrs,
+    ### they are expanded all at once
+    expanded = SHORT_URLS.resolve([link for link in links if check_shorter_url(link)])
+    for link in links:
+        url = expanded.get(link, link)
+        if url is not None and YouTubeResource.is_youtube(url, get_channel=False):
+            urls.add(url.strip())
+    return urls
+
+
 class CollectionSection(object):
     def __init__(self,  page, filename=None, id_=None, menu_name=None, resource_url=None,
-                lang="en"):
+                lang="en", index=None):
         LOGGER.debug(id_)
         self.id = id_
         if id_ is None:
             self.body = page
+        elif index is not None:
+            self.body = index.section(id_)
         else:
             self.body = page.find("section", id=id_)
 
@@ -700,44 +1152,46 @@ class CollectionSection(object):
         return "".join([str(p) for p in self.body])
 
     def get_pdfs(self):
-        urls = {}
         if self.body is not None:
-            resource_links = self.body.find_all("a", href=re.compile("^\/content|https\:\/\/www.teachengineering"))
-            for link in resource_links:
-                if link["href"].endswith(".pdf") and link["href"] not in urls:
-                    filename = get_name_from_url(link["href"])
-                    name = link.text.replace("(pdf)", "").strip()
-                    urls[link["href"]] = (filename, name, urljoin(BASE_URL, link["href"]))
-            return urls.values()
-
-    def build_pdfs_info(self, path, license=None):
-        pdfs_urls = self.get_pdfs()
+            resource_links = self.body.find_all("a", href=PDF_LINK_RE)
+            return collect_pdfs((link["href"], link.text) for link in resource_links)
+
+    def build_pdfs_info(self, path, license=None, pdfs_urls=None):
+        if pdfs_urls is None:
+            pdfs_urls = self.get_pdfs()
         if len(pdfs_urls) == 0:
             return
 
         PDFS_DATA_DIR = build_path([path, 'pdfs'])
-        files_list = []
-        for filename, name, pdf_url in pdfs_urls:
+
+        def link_pdf(pdf):
+            filename, name, pdf_url = pdf
             try:
-                response = downloader.read(pdf_url)
-                pdf_filepath = os.path.join(PDFS_DATA_DIR, filename)
-                with open(pdf_filepath, 'wb') as f:
-                    f.write(response)
-                files = dict(
-                    kind=content_kinds.DOCUMENT,
-                    source_id=pdf_url,
-                    title=name,
-                    description='',
-                    files=[dict(
-                        file_type=content_kinds.DOCUMENT,
-                        path=pdf_filepath
-                    )],
-                    language=self.lang,
-                    license=license)
-                files_list.append(files)
-            except requests.exceptions.HTTPError as e:
+                return ASSETS.link(pdf_url, os.path.join(PDFS_DATA_DIR, filename))
+            except requests.exceptions.RequestException as e:
                 LOGGER.info("Error: {}".format(e))
 
+        #the store bounds the downloads running at the same time for all the collections
+        with ThreadPoolExecutor(max_workers=ASSETS.workers) as executor:
+            pdfs_filepaths = list(executor.map(link_pdf, pdfs_urls))
+
+        files_list = []
+        for (filename, name, pdf_url), pdf_filepath in zip(pdfs_urls, pdfs_filepaths):
+            if pdf_filepath is None:
+                continue
+            files = dict(
+                kind=content_kinds.DOCUMENT,
+                source_id=pdf_url,
+                title=name,
+                description='',
+                files=[dict(
+                    file_type=content_kinds.DOCUMENT,
+                    path=pdf_filepath
+                )],
+                language=self.lang,
+                license=license)
+            files_list.append(files)
+
         return files_list
 
     def get_domain_links(self):
@@ -769,73 +1223,28 @@ class CollectionSection(object):
         return [a.get("href", None) for a in self.body.find_all(check_link)]
 
     def get_videos_urls(self):
-        urls = set([])
-        for iframe in self.body.find_all("iframe"):
-            url = iframe["src"]
-            if YouTubeResource.is_youtube(url):
-                urls.add(YouTubeResource.transform_embed(url))
-            iframe.extract()
-
-        queue = self.body.find_all("a", href=re.compile("^http"))
-        max_tries = 3
-        num_tries = 0
-        while queue:
-            try:
-                a = queue.pop(0)
-                ### some links who are youtube resources have shorted thier ulrs
-                ### with session.head we can expand it
-                if check_shorter_url(a["href"]):
-                    resp = sess.head(a["href"], allow_redirects=True)
-                    url = resp.url
-                else:
-                    url = a["href"]
-                if YouTubeResource.is_youtube(url, get_channel=False):
-                    urls.add(url.strip())
-            except requests.exceptions.MissingSchema:
-                pass
-            except requests.exceptions.TooManyRedirects:
-                LOGGER.info("Too many redirections, skip resource: {}".format(a["href"]))
-            except requests.exceptions.ConnectionError:
-                ### this is a weird error, perhaps it's raised when teachengineering's webpage
-                ### is slow to respond requested resources
-                LOGGER.info(a["href"])
-                num_tries += 1
-                LOGGER.info("Connection error, the resource will be scraped in 3s... num try {}".format(num_tries))
-                if num_tries < max_tries:
-                    queue.insert(0, a)
-                else:
-                    LOGGER.info("Connection error, give up.")
-                time.sleep(3)
-            except KeyError:
-                pass
-            else:
-                num_tries = 0
-        return urls
+        return collect_videos_urls([iframe["src"] for iframe in self.body.find_all("iframe")],
+            [a["href"] for a in self.body.find_all("a", href=re.compile("^http"))])
 
-    def build_videos_info(self, path, license=None):
-        videos_urls = self.get_videos_urls()
+    def build_videos_info(self, license=None, videos_urls=None):
+        if videos_urls is None:
+            videos_urls = self.get_videos_urls()
         if len(videos_urls) == 0:
             return
 
-        VIDEOS_DATA_DIR = build_path([path, 'videos'])
-        videos_list = []
-
-        for i, url in enumerate(videos_urls):
-            resource = YouTubeResource(url, lang=self.lang)
-            resource.to_file(filepath=VIDEOS_DATA_DIR)
-            if resource.resource_file is not None:
-                videos_list.append(resource.resource_file)
-        return videos_list
+        videos_list = OrderedDict()
+        for url in videos_urls:
+            placeholder = VIDEOS.submit(url, lang=self.lang)
+            videos_list.setdefault(placeholder["source_id"], placeholder)
+        return list(videos_list.values())
 
-    def write(self, filename, content):
-        with html_writer.HTMLWriter(self.filename, "a") as zipper:
-            zipper.write_contents(filename, content, directory="files")
+    def write(self, zipper, filename, content):
+        zipper.write_contents(filename, content, directory="files")
 
-    def write_img(self, url, filename):
-        with html_writer.HTMLWriter(self.filename, "a") as zipper:
-            zipper.write_url(url, filename, directory="files")
+    def write_img(self, zipper, url, filename):
+        zipper.write_url(url, filename, directory="files")
 
-    def to_file(self, filename, menu_index=None):
+    def to_file(self, filename, zipper, menu_index=None):
         if self.body is not None and filename is not None:
             images = self.get_imgs()
             content = self.get_content()
@@ -847,15 +1256,54 @@ class CollectionSection(object):
                 html = '<html><head><meta charset="utf-8"><link rel="stylesheet" href="../css/styles.css"></head><body><div class="main-content-with-sidebar">{}</div><script src="../js/scripts.js"></script></body></html>'.format(
                     content)
 
-            self.write(filename, html)
+            self.write(zipper, filename, html)
             for img_src, img_filename in images:
-                self.write_img(img_src, img_filename)
+                self.write_img(zipper, img_src, img_filename)
+            self.rendered = (filename, html, images)
+
+    def extraction(self):
+        """
+            Returns what is needed to write the section again without the page
+        """
+        menu_filename, html, images = getattr(self, "rendered", (None, None, []))
+        return dict(
+            id=self.id,
+            menu_name=self.menu_name,
+            menu_filename=menu_filename,
+            html=html,
+            images=images,
+            img_url=self.img_url,
+            schedule=getattr(self, "schedule", []))
+
+
+class ExtractedSection(CollectionSection):
+    """
+        A section rendered in a previous run, it's written from its extraction record
+    """
+    def __init__(self, filename, id=None, menu_name=None, menu_filename=None, html=None,
+                images=None, img_url=None, schedule=None):
+        self.id = id
+        self.body = None
+        self.title = None
+        self.filename = filename
+        self.menu_name = menu_name
+        self.menu_filename = menu_filename
+        self.html = html
+        self.images = [] if images is None else images
+        self.img_url = img_url
+        self.schedule = [] if schedule is None else schedule
+
+    def to_file(self, filename, zipper, menu_index=None):
+        if self.html is not None and filename is not None:
+            self.write(zipper, filename, self.html)
+            for img_src, img_filename in self.images:
+                self.write_img(zipper, img_src, img_filename)
 
 
 class CurriculumHeader(CollectionSection):
     def __init__(self, page, filename=None, id_="curriculum-header", 
-                menu_name="summary", lang="en", resource_url=None):
-        self.body = page.find("div", class_="curriculum-header")
+                menu_name="summary", lang="en", resource_url=None, index=None):
+        self.body = find_div(page, class_="curriculum-header", index=index)
         self.filename = filename
         self.menu_name = menu_name
         self.id = id_
@@ -865,10 +1313,11 @@ class CurriculumHeader(CollectionSection):
 
 class QuickLook(CollectionSection):
     def __init__(self, page, filename=None, id_="quick", menu_name="quick_look", 
-            lang="en", resource_url=None):
+            lang="en", resource_url=None, index=None):
         super(QuickLook, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
-        self.body = page.find("div", class_="quick-look")
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
+        self.body = find_div(page, class_="quick-look", index=index)
         ## cleaning html code
         for s in self.body.find_all("script"):
             s.extract()
@@ -878,8 +1327,17 @@ class QuickLook(CollectionSection):
         div.extract()
 
     def get_subject_area(self):
-        subject_areas = self.body.find_all(lambda tag: tag.name == 'a' and\
-                        tag.findParent("dd", class_="subject-area"))
+        return QuickLook.subject_area_links(self.body)
+
+    @staticmethod
+    def subject_area_links(body):
+        if body is None:
+            return []
+        #the links on the buttons and the share modal are not subject areas
+        subject_areas = body.find_all(lambda tag: tag.name == 'a' and\
+                        tag.findParent("dd", class_="subject-area") and\
+                        not tag.findParent("button") and\
+                        not tag.findParent("div", id="PrintShareModal"))
         subjects = []
         for a in subject_areas:
             subjects.append(a.text)
@@ -888,9 +1346,11 @@ class QuickLook(CollectionSection):
 
 class UnitSchedule(CollectionSection):
     def __init__(self, page, filename=None, id_=None, 
-                menu_name=None, lang="en", resource_url=None):
+                menu_name=None, lang="en", resource_url=None, index=None):
         super(UnitSchedule, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
+        self.schedule = []
         if self.body is not None:
             self.get_schedule(self.body.find_all("a"))
 
@@ -901,39 +1361,40 @@ class UnitSchedule(CollectionSection):
                 if relative_url.startswith("/") and "curricularunits" not in relative_url\
                     and not relative_url.endswith("pdf"):
                     lesson_url = urljoin(BASE_URL, a["href"]).strip()
-                    if lesson_url not in CURRICULAR_UNITS_MAP[self.resource_url]:               
-                        CURRICULAR_UNITS_MAP[self.resource_url][lesson_url] = len(CURRICULAR_UNITS_MAP[self.resource_url])
-                    LESSONS_CURRICULAR_MAP[lesson_url].add(self.resource_url)
+                    self.schedule.append(lesson_url)
 
 
 class EngineeringConnection(CollectionSection):
     def __init__(self, page, filename=None, id_="engineering_connection", 
-                menu_name="engineering_connection", lang="en", resource_url=None):
+                menu_name="engineering_connection", lang="en", resource_url=None, index=None):
         super(EngineeringConnection, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
-        self.body = page.find(lambda tag: tag.name=="section" and\
-            tag.findChildren("h3", text=re.compile("\s*Engineering Connection\s*")))
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
+        self.body = find_section_with_heading(page, "Engineering Connection", index=index)
 
 
 class Summary(CollectionSection):
     def __init__(self, page, filename=None, id_="summary", menu_name="summary", 
-                lang="en", resource_url=None):
+                lang="en", resource_url=None, index=None):
         super(Summary, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
 
 
 class Introduction(CollectionSection):
     def __init__(self, page, filename=None, id_="intro", menu_name="introduction", 
-                lang="en", resource_url=None):
+                lang="en", resource_url=None, index=None):
         super(Introduction, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
 
 
 class Attachments(CollectionSection):
     def __init__(self, page, filename=None, id_="attachments", 
-                menu_name="attachments", lang="en", resource_url=None):
+                menu_name="attachments", lang="en", resource_url=None, index=None):
         super(Attachments, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
 
     def get_content(self):
         remove_iframes(self.body)
@@ -948,38 +1409,38 @@ class Attachments(CollectionSection):
 
 class Contributors(CollectionSection):
     def __init__(self, page, filename=None, id_="contributors", 
-            menu_name="contributors", lang="en", resource_url=None):
+            menu_name="contributors", lang="en", resource_url=None, index=None):
         super(Contributors, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
-        self.body = page.find(lambda tag: tag.name=="section" and\
-            tag.findChildren("h3", text=re.compile("\s*Contributors\s*")))
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
+        self.body = find_section_with_heading(page, "Contributors", index=index)
 
 
 class SupportingProgram(CollectionSection):
     def __init__(self, page, filename=None, id_="supporting_program", 
-                menu_name="supporting_program", lang="en", resource_url=None):
+                menu_name="supporting_program", lang="en", resource_url=None, index=None):
         super(SupportingProgram, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
-        self.body = page.find(lambda tag: tag.name=="section" and\
-            tag.findChildren("h3", text=re.compile("\s*Supporting Program\s*")))
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
+        self.body = find_section_with_heading(page, "Supporting Program", index=index)
 
 
 class Acknowledgements(CollectionSection):
     def __init__(self, page, filename=None, id_="acknowledgements", 
-                menu_name="acknowledgements", lang="en", resource_url=None):
+                menu_name="acknowledgements", lang="en", resource_url=None, index=None):
         super(Acknowledgements, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
-        self.body = page.find(lambda tag: tag.name=="section" and\
-            tag.findChildren("h3", text=re.compile("\s*Acknowledgements\s*")))
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
+        self.body = find_section_with_heading(page, "Acknowledgements", index=index)
 
 
 class Copyright(CollectionSection):
     def __init__(self, page, filename=None, id_="copyright", menu_name="copyright", 
-                lang="en", resource_url=None):
+                lang="en", resource_url=None, index=None):
         super(Copyright, self).__init__(page, filename=filename,
-                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url)
-        self.body = page.find(lambda tag: tag.name=="section" and\
-            tag.findChildren("h3", text=re.compile("\s*Copyright\s*")))
+                id_=id_, menu_name=menu_name, lang=lang, resource_url=resource_url,
+                index=index)
+        self.body = find_section_with_heading(page, "Copyright", index=index)
 
     def get_copyright_info(self):
         text = self.body.text
@@ -1033,21 +1494,20 @@ class ImagesListResource(object):
         tag += "</ul>"
         return tag
 
-    def write_img(self, url, filename):
-        with html_writer.HTMLWriter(self.filepath, "a") as zipper:
-            zipper.write_url(url, filename, directory=self.prefix)
+    def write_img(self, zipper, url, filename):
+        zipper.write_url(url, filename, directory=self.prefix)
 
-    def write(self, content):
-        with html_writer.HTMLWriter(self.filepath, "w") as zipper:
-            zipper.write_index_contents(content)
+    def write(self, zipper, content):
+        zipper.write_index_contents(content)
 
     def to_file(self):
         content = self.menu()
         html = '<html><head><meta charset="utf-8"><link rel="stylesheet" href="css/styles.css"></head><body><div class="main-content-with-sidebar">{}</div><script src="scripts.js"></script></body></html>'.format(
             content)
-        self.write(content)
-        for img_url in self.urls:
-            self.write_img(img_url, get_name_from_url(img_url))
+        with ZipBuilder(self.filepath) as zipper:
+            self.write(zipper, content)
+            for img_url in self.urls:
+                self.write_img(zipper, img_url, get_name_from_url(img_url))
 
     def info(self):
         return dict(
@@ -1067,13 +1527,18 @@ class ImagesListResource(object):
 
 
 class YouTubeResource(ResourceType):
-    def __init__(self, resource_url, type_name="Youtube", lang="en"):
+    def __init__(self, resource_url, type_name="Youtube", lang="en", ratelimit=None):
         super(YouTubeResource, self).__init__(resource_url=self.clean_url(resource_url), 
             type_name=type_name)
         self.file_format = file_formats.MP4
         self.lang = lang
+        self.ratelimit = ratelimit
         self.filepath = None
         self.filename = None
+        self.youtube_id = self.get_video_id(self.resource_url)
+        self.subtitles = []
+        #True when youtube_dl can't get the video (unavailable, private, ...), it's not retried
+        self.unavailable = False
 
     def clean_url(self, url):
         if url[-1] == "/":
@@ -1092,6 +1557,29 @@ class YouTubeResource(ResourceType):
         url = "".join(url.split("?")[:1])
         return url.replace("embed/", "watch?v=").strip()
 
+    @classmethod
+    def canonical_url(self, url):
+        """
+            Returns the watch url of the video, the embeds, watch?v= and youtu.be links
+            of a video have the same canonical url
+        """
+        video_id = self.get_video_id(url)
+        if video_id is None:
+            return url.strip()
+        return "https://www.youtube.com/watch?v={}".format(video_id)
+
+    @classmethod
+    def get_video_id(self, url):
+        parsed_url = urlparse(url)
+        segments = parsed_url.path.strip("/").split("/")
+        if parsed_url.netloc.endswith("youtu.be"):
+            return segments[0] or None
+        query = parse_qs(parsed_url.query)
+        if "v" in query:
+            return query["v"][0]
+        if len(segments) > 1 and segments[0] in ("embed", "v"):
+            return segments[1]
+
     def get_video_info(self, download_to=None, subtitles=True):
         ydl_options = {
                 'writesubtitles': subtitles,
@@ -1104,6 +1592,8 @@ class YouTubeResource(ResourceType):
                 'outtmpl': '{}/%(id)s'.format(download_to),
                 'noplaylist': False
             }
+        if self.ratelimit:
+            ydl_options['ratelimit'] = self.ratelimit
 
         with youtube_dl.YoutubeDL(ydl_options) as ydl:
             try:
@@ -1114,17 +1604,41 @@ class YouTubeResource(ResourceType):
                     youtube_dl.utils.ExtractorError) as e:
                 LOGGER.info('An error occured ' + str(e))
                 LOGGER.info(self.resource_url)
+                #a partial download can be resumed, the other errors are permanent
+                self.unavailable = not isinstance(e, youtube_dl.utils.ContentTooShortError)
             except KeyError as e:
                 LOGGER.info(str(e))
 
+    def cached_info(self):
+        """
+            Returns the info of a video downloaded in a previous run, None if
+            it's not cached or its file is missing
+        """
+        if VIDEOS_INFO is None or self.youtube_id is None:
+            return
+        video_info = VIDEOS_INFO.get(self.youtube_id)
+        if video_info is not None and if_file_exists(video_info["filepath"]) and\
+            os.stat(video_info["filepath"]).st_size > 0:
+            return video_info
+
+    def set_info(self, video_info):
+        self.youtube_id = video_info["id"]
+        self.filepath = video_info["filepath"]
+        self.filename = video_info["title"]
+        self.subtitles = video_info["subtitles"]
+
+    def subtitles_languages(self):
+        video_info = self.cached_info()
+        if video_info is not None:
+            return video_info["subtitles"]
+        info = self.get_video_info()
+        if isinstance(info, dict) and len(info.keys()) > 0:
+            return list(info.get("subtitles", {}).keys())
+
     def subtitles_dict(self):
-        video_info = self.get_video_info()
-        video_id = video_info["id"]
         subs = []
-        if 'subtitles' in video_info:
-            subtitles_info = video_info["subtitles"]
-            for language in subtitles_info.keys():
-                subs.append(dict(file_type=SUBTITLES_FILE, youtube_id=video_id, language=language))
+        for language in self.subtitles:
+            subs.append(dict(file_type=SUBTITLES_FILE, youtube_id=self.youtube_id, language=language))
         return subs
 
     def process_file(self, download=False, filepath=None):
@@ -1142,39 +1656,154 @@ class YouTubeResource(ResourceType):
                 language=self.lang,
                 license=get_license(licenses.CC_BY, copyright_holder=GENERAL_COPYRIGHT_HOLDER).as_dict()))
 
+    def downloadable(self, download=True):
+        return "watch?" in self.resource_url and not "/user/" in self.resource_url and\
+            download is not False
+
     def download(self, download=True, base_path=None):
-        if not "watch?" in self.resource_url or "/user/" in self.resource_url or\
-            download is False:
+        if not self.downloadable(download=download):
+            return
+
+        video_info = self.cached_info()
+        if video_info is not None:
+            LOGGER.info("Video info from cache: {}".format(self.youtube_id))
+            self.set_info(video_info)
+            return
+        if ARCHIVE is not None and ARCHIVE.mode == "replay":
+            #youtube_dl doesn't use requests, its downloads can't be replayed
+            LOGGER.info("Video not in the videos cache, skipped in replay: {}".format(self.resource_url))
+            self.unavailable = True
             return
 
         download_to = base_path
-        for i in range(4):
-            try:
-                info = self.get_video_info(download_to=download_to, subtitles=False)
-                if info is not None:
-                    LOGGER.info("Video resolution: {}x{}".format(info.get("width", ""), info.get("height", "")))
-                    self.filepath = os.path.join(download_to, "{}.mp4".format(info["id"]))
-                    self.filename = info["title"]
-                    if self.filepath is not None and os.stat(self.filepath).st_size == 0:
-                        LOGGER.info("Empty file")
-                        self.filepath = None
-            except (ValueError, IOError, OSError, URLError, ConnectionResetError) as e:
-                LOGGER.info(e)
-                LOGGER.info("Download retry")
-                time.sleep(.8)
-            except (youtube_dl.utils.DownloadError, youtube_dl.utils.ContentTooShortError,
-                    youtube_dl.utils.ExtractorError, OSError) as e:
-                LOGGER.info("An error ocurred, may be the video is not available.")
-                return
-            except OSError:
-                return
-            else:
-                return
+        #a failed download is retried by VIDEOS, behind the pending ones
+        try:
+            #the info returned by the download has the subtitles, it's not requested again
+            info = self.get_video_info(download_to=download_to, subtitles=False)
+            if info is not None:
+                LOGGER.info("Video resolution: {}x{}".format(info.get("width", ""), info.get("height", "")))
+                video_info = dict(
+                    id=info["id"],
+                    title=info["title"],
+                    filepath=os.path.join(download_to, "{}.mp4".format(info["id"])),
+                    formats=[f.get("format_id") for f in info.get("requested_formats") or [info]],
+                    width=info.get("width"),
+                    height=info.get("height"),
+                    subtitles=list((info.get("subtitles") or {}).keys()))
+                if os.stat(video_info["filepath"]).st_size == 0:
+                    LOGGER.info("Empty file")
+                else:
+                    self.set_info(video_info)
+                    if VIDEOS_INFO is not None:
+                        VIDEOS_INFO.set(self.youtube_id, video_info)
+        except (ValueError, IOError, OSError, URLError, ConnectionResetError) as e:
+            LOGGER.info(e)
+            LOGGER.info("Download failed: {}".format(self.resource_url))
+        except (youtube_dl.utils.DownloadError, youtube_dl.utils.ExtractorError):
+            LOGGER.info("An error ocurred, may be the video is not available.")
+            self.unavailable = True
+        except youtube_dl.utils.ContentTooShortError as e:
+            LOGGER.info("Download failed: {} {}".format(self.resource_url, e))
 
     def to_file(self, filepath=None):
         self.process_file(download=DOWNLOAD_VIDEOS, filepath=filepath)
 
 
+class VideoPool(object):
+    """
+        Downloads each video once per run to VIDEOS_DIR, the urls are registered by
+        youtube id. The downloads run in background threads: the scraping gets a
+        placeholder node for each video and finalize replaces them when the tree is
+        finished. A failed download is queued again after the backoff of SCHEDULER,
+        an unavailable video isn't retried. ratelimit (bytes/s) is the bandwidth
+        shared by all the workers.
+    """
+    def __init__(self, workers=2, ratelimit=None, tries=3, directory=VIDEOS_DIR):
+        self.workers = workers
+        self.ratelimit = ratelimit // workers if ratelimit else None
+        self.tries = tries
+        self.directory = directory
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        #canonical url -> Future with the resource file
+        self.videos = {}
+        #canonical url -> urls and number of nodes that reference the video
+        self.urls = defaultdict(set)
+        self.references = Counter()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def submit(self, url, lang="en"):
+        canonical_url = YouTubeResource.canonical_url(url)
+        with self.lock:
+            self.urls[canonical_url].add(url)
+            self.references[canonical_url] += 1
+            if canonical_url not in self.videos:
+                self.videos[canonical_url] = Future()
+                self.executor.submit(self.download, canonical_url, lang, 1)
+        return dict(kind=VIDEO_PLACEHOLDER, source_id=canonical_url, language=lang)
+
+    def download(self, url, lang, attempt):
+        resource = YouTubeResource(url, lang=lang, ratelimit=self.ratelimit)
+        try:
+            resource.to_file(filepath=build_path([self.directory]))
+        except Exception as e:
+            LOGGER.info("Video error {}: {}".format(url, e))
+        if resource.resource_file is None and resource.downloadable(download=DOWNLOAD_VIDEOS)\
+            and not resource.unavailable and attempt < self.tries:
+            #youtube_dl doesn't go through SCHEDULER, only the delay of its retries
+            delay = SCHEDULER.delay(url, attempt - 1)
+            LOGGER.info("Video download failed, retry {} in {:.1f}s: {}".format(attempt, delay, url))
+            with self.lock:
+                self.stats["retries"] += 1
+            timer = threading.Timer(delay, self.executor.submit,
+                                    args=(self.download, url, lang, attempt + 1))
+            timer.daemon = True
+            timer.start()
+            return
+        with self.lock:
+            self.stats["downloaded" if resource.resource_file is not None else "failed"] += 1
+        self.videos[url].set_result(resource.resource_file)
+
+    def finalize(self, tree):
+        """
+            Waits for the videos of tree and replaces its placeholders, the placeholders
+            of the videos that couldn't be downloaded are removed
+        """
+        removed = 0
+        nodes = [tree]
+        while nodes:
+            node = nodes.pop()
+            children = []
+            for child in node.get("children", []):
+                if child.get("kind") != VIDEO_PLACEHOLDER:
+                    children.append(child)
+                    nodes.append(child)
+                    continue
+                resource_file = self.videos[child["source_id"]].result()
+                if resource_file is not None:
+                    children.append(dict(resource_file, language=child["language"]))
+                else:
+                    removed += 1
+            if "children" in node:
+                node["children"][:] = children
+        LOGGER.info("Videos: {} downloaded, {} failed, {} retries, {} placeholders removed".format(
+            self.stats["downloaded"], self.stats["failed"], self.stats["retries"], removed))
+        self.report()
+
+    def report(self):
+        shared = [url for url, references in self.references.items() if references > 1]
+        LOGGER.info("Videos registry: {} videos for {} references ({} urls), {} downloads saved".format(
+            len(self.videos), sum(self.references.values()),
+            sum(len(urls) for urls in self.urls.values()),
+            sum(self.references.values()) - len(self.videos)))
+        for url in sorted(shared, key=lambda url: -self.references[url]):
+            LOGGER.info("   - {} x{}: {}".format(url, self.references[url],
+                ", ".join(sorted(self.urls[url]))))
+
+
+VIDEOS = VideoPool()
+
+
 def if_file_exists(filepath):
     file_ = Path(filepath)
     return file_.is_file()
@@ -1200,6 +1829,254 @@ def get_name_from_url_no_ext(url):
     return name
 
 
+class SectionIndex(object):
+    """
+        Index of the page's sections, built in one traversal: the sections by id,
+        the outermost section around each h3 heading and the divs by class and id.
+        The lookups skip the tags that were moved out of the page.
+    """
+    def __init__(self, page):
+        self.page = page
+        self.sections = defaultdict(list)
+        self.headings = []
+        self.divs_class = defaultdict(list)
+        self.divs_id = defaultdict(list)
+        for tag in page.find_all(["section", "div", "h3"]):
+            if tag.name == "section":
+                self.sections[tag.get("id")].append(tag)
+            elif tag.name == "div":
+                for class_ in tag.get("class", []):
+                    self.divs_class[class_].append(tag)
+                if tag.get("id") is not None:
+                    self.divs_id[tag["id"]].append(tag)
+            elif tag.string is not None:
+                section = None
+                for parent in tag.parents:
+                    if parent.name == "section":
+                        section = parent
+                if section is not None:
+                    self.headings.append((tag.string, section))
+
+    def attached(self, tag):
+        for parent in tag.parents:
+            if parent is self.page:
+                return True
+        return False
+
+    def first_attached(self, tags):
+        for tag in tags:
+            if self.attached(tag):
+                return tag
+
+    def section(self, id_):
+        return self.first_attached(self.sections.get(id_, []))
+
+    def section_with_heading(self, heading):
+        heading_re = re.compile(r"\s*{}\s*".format(re.escape(heading)))
+        return self.first_attached(section for text, section in self.headings 
+                                    if heading_re.search(text))
+
+    def div(self, class_=None, id_=None):
+        if class_ is not None:
+            return self.first_attached(self.divs_class.get(class_, []))
+        return self.first_attached(self.divs_id.get(id_, []))
+
+
+def find_div(page, class_=None, id_=None, index=None):
+    if index is not None:
+        return index.div(class_=class_, id_=id_)
+    if class_ is not None:
+        return page.find("div", class_=class_)
+    return page.find("div", id=id_)
+
+
+def find_section_with_heading(page, heading, index=None):
+    if index is not None:
+        return index.section_with_heading(heading)
+    return page.find(lambda tag: tag.name=="section" and\
+        tag.findChildren("h3", text=re.compile(r"\s*{}\s*".format(re.escape(heading)))))
+
+
+def collection_region(name, attrs):
+    """
+        True for the tags of a collection page read by the chef: the menu, the header,
+        the quick look box, the sections, the title, the description and the
+        Living Labs content
+    """
+    classes = attrs.get("class") or []
+    if isinstance(classes, str):
+        classes = classes.split()
+    if name == "section":
+        return True
+    if name == "div":
+        return attrs.get("id") == "CurriculumNav" or\
+            any(class_ in ("curriculum-header", "quick-look", "page-wrapper") for class_ in classes)
+    if name == "span":
+        return any(class_ in ("title-prefix", "curriculum-title") for class_ in classes)
+    if name == "meta":
+        return attrs.get("property") == "og:description"
+    return False
+
+
+class CollectionStrainer(SoupStrainer):
+    """
+        Strainer of the collection_region tags for bs4 >= 4.13, its SoupStrainer calls
+        a function with the tag name only and checks the attrs apart
+    """
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return collection_region(name, attrs or {})
+
+    def allow_string_creation(self, string):
+        return False
+
+
+def collection_strainer():
+    if hasattr(SoupStrainer, "allow_tag_creation"):
+        return CollectionStrainer()
+    #bs4 < 4.13 calls the function with the name and the attrs of the tag
+    return SoupStrainer(collection_region)
+
+
+def parse_html(document, strained=False):
+    """
+        Returns the BeautifulSoup tree of document built with the HTML_PARSER backend,
+        if strained is True only the collection_region tags are parsed
+    """
+    features = "lxml" if HTML_PARSER == "selectolax" else HTML_PARSER
+    if features == "lxml" and lxml is None:
+        features = "html.parser"
+    parse_only = collection_strainer() if strained else None
+    return BeautifulSoup(document, features, parse_only=parse_only)
+
+
+def use_selectolax():
+    return HTML_PARSER == "selectolax" and LexborHTMLParser is not None
+
+
+def get_scripts_text(document):
+    if use_selectolax():
+        return [script.text() for script in LexborHTMLParser(document).css("script")]
+    return [script.text for script in parse_html(document).find_all("script")]
+
+
+def in_node(node, tag, id_=None):
+    """
+        True if a selectolax node has an ancestor tag (with the id id_)
+    """
+    parent = node.parent
+    while parent is not None:
+        if parent.tag == tag and (id_ is None or parent.attributes.get("id") == id_):
+            return True
+        parent = parent.parent
+    return False
+
+
+def get_subjects_area_from_document(document):
+    """
+        Read-only extraction of the subject areas listed on the quick look box
+    """
+    if use_selectolax():
+        return lexbor_subjects_area(LexborHTMLParser(document))
+    return QuickLook.subject_area_links(parse_html(document).find("div", class_="quick-look"))
+
+
+def lexbor_subjects_area(tree):
+    quick_look = tree.css_first("div.quick-look")
+    if quick_look is None:
+        return []
+    #the links on the buttons and the share modal are not subject areas, like
+    #in QuickLook.subject_area_links
+    return [a.text() for a in quick_look.css("dd.subject-area a")
+            if not in_node(a, "button") and not in_node(a, "div", id_="PrintShareModal")]
+
+
+#the tags of collection_region as a css selector
+COLLECTION_REGION_CSS = ", ".join(["section", "div#CurriculumNav", "div.curriculum-header",
+    "div.quick-look", "div.page-wrapper", "span.title-prefix", "span.curriculum-title",
+    "meta[property='og:description']"])
+
+
+def lexbor_region(tree, strained=False):
+    """
+        Returns the nodes parsed by parse_html: the document, or the outermost
+        collection_region nodes if strained is True
+    """
+    if not strained:
+        return [tree.root]
+    nodes = tree.css(COLLECTION_REGION_CSS)
+    matched = set(node.mem_id for node in nodes)
+    roots = []
+    for node in nodes:
+        parent = node.parent
+        while parent is not None and parent.mem_id not in matched:
+            parent = parent.parent
+        if parent is None:
+            roots.append(node)
+    return roots
+
+
+def lexbor_string(node):
+    """
+        The text of node if it has a single string, like Tag.string
+    """
+    children = list(node.iter(include_text=True))
+    if len(children) != 1:
+        return None
+    if children[0].is_text_node:
+        return children[0].text()
+    return lexbor_string(children[0])
+
+
+def lexbor_copyright(tree, roots):
+    """
+        Like Copyright.get_copyright_info, the text from © of the outermost
+        section of the Copyright heading
+    """
+    heading_re = re.compile(r"\s*{}\s*".format(re.escape("Copyright")))
+    for root in roots:
+        for h3 in root.css("h3"):
+            text = lexbor_string(h3)
+            if text is None or not heading_re.search(text):
+                continue
+            section = None
+            parent = h3.parent
+            while parent is not None:
+                if parent.tag == "section":
+                    section = parent
+                parent = parent.parent
+            if section is None:
+                continue
+            text = section.text()
+            index = text.find("©")
+            if index != -1:
+                copyright = text[index:].strip()
+                LOGGER.info("   - COPYRIGHT INFO:" + copyright)
+                return copyright
+            return ""
+    return ""
+
+
+def extract_document(document, strained=False):
+    """
+        The read-only extraction of Collection.extract with selectolax (lexbor): the
+        description, copyright, subject areas, pdfs and videos of the page
+    """
+    tree = LexborHTMLParser(document)
+    roots = lexbor_region(tree, strained=strained)
+    descr = tree.css_first("meta[property='og:description']")
+    links = [a for root in roots for a in root.css("a[href]")]
+    iframes_srcs = [iframe.attributes.get("src") for root in roots for iframe in root.css("iframe")]
+    hrefs = [a.attributes.get("href") or "" for a in links]
+    return dict(
+        description=(descr.attributes.get("content") or "") if descr is not None else "",
+        copyright=lexbor_copyright(tree, roots),
+        subjects_area=lexbor_subjects_area(tree),
+        pdfs=list(collect_pdfs((href, a.text()) for href, a in zip(hrefs, links)
+                            if PDF_LINK_RE.search(href))),
+        videos_urls=sorted(collect_videos_urls([src for src in iframes_srcs if src],
+            [href for href in hrefs if href.startswith("http")])))
+
+
 def remove_links(content):
     if content is not None:
         for link in content.find_all("a"):
@@ -1211,23 +2088,902 @@ def remove_iframes(content):
             iframe.extract()
 
 
+SHORTENERS = set(["bit.ly", "bitly.com", "j.mp", "goo.gl", "tinyurl.com", "ow.ly", "is.gd",
+                "ls.gd", "buff.ly", "adf.ly", "bit.do", "mcaf.ee", "t.co", "tiny.cc",
+                "rebrand.ly", "cutt.ly", "shorturl.at", "lnkd.in", "po.st", "x.co"])
+
+
 def check_shorter_url(url):
-    shorters_urls = set(["bitly.com", "goo.gl", "tinyurl.com", "ow.ly", "ls.gd",
-                "buff.ly", "adf.ly", "bit.do", "mcaf.ee"])
-    index_init = url.find("://")
-    index_end = url[index_init+3:].find("/")
-    if index_init != -1:
-        if index_end == -1:
-            index_end = len(url[index_init+3:])
-        domain = url[index_init+3:index_end+index_init+3]
-        check = len(domain) < 12 or domain in shorters_urls
-        return check
+    domain = urlparse(url).netloc.lower()
+    if domain.startswith("www."):
+        domain = domain[4:]
+    return domain in SHORTENERS
+
+
+class ShortUrlResolver(object):
+    """
+        Expands the short links concurrently, the targets are kept in store (a
+        JsonStore, None to keep them only in memory). A link that can't be
+        expanded resolves to None.
+    """
+    def __init__(self, store=None, workers=8):
+        self.store = store
+        self.workers = workers
+        self.resolved = {}
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def resolve(self, urls):
+        """
+            Returns a dict with the target of each url
+        """
+        targets = {}
+        pending = []
+        with self.lock:
+            for url in set(urls):
+                if url in self.resolved:
+                    targets[url] = self.resolved[url]
+                elif self.store is not None and self.store.get(url) is not None:
+                    targets[url] = self.store.get(url)["target"]
+                else:
+                    pending.append(url)
+            self.stats["cached"] += len(targets)
+        if len(pending) > 0:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as executor:
+                targets.update(zip(pending, executor.map(self.expand, pending)))
+        return targets
+
+    def expand(self, url):
+        target = None
+        answered = True
+        #the connection errors are retried by SCHEDULER
+        try:
+            response = sess.head(url, allow_redirects=True)
+            if response.status_code >= 500:
+                #the shortener is failing, the link is expanded again on the next run
+                LOGGER.info("Error expanding {}: {}".format(url, response.status_code))
+                answered = False
+            else:
+                target = response.url
+        except (requests.exceptions.TooManyRedirects, requests.exceptions.InvalidSchema,
+                requests.exceptions.InvalidURL, requests.exceptions.MissingSchema) as e:
+            #the shortener answered with a redirection that can't be followed
+            LOGGER.info("Bad redirection, skip resource: {} {}".format(url, e))
+        except requests.exceptions.RequestException as e:
+            LOGGER.info("Error expanding {}: {}".format(url, e))
+            answered = False
+        with self.lock:
+            self.stats["expanded"] += 1
+            self.resolved[url] = target
+            #the errors can be temporal, only the definitive answers are stored
+            if self.store is not None and answered:
+                self.store.set(url, {"target": target})
+        return target
+
+    def save(self):
+        if self.store is not None:
+            with self.lock:
+                self.store.save()
+
+    def report(self):
+        LOGGER.info("Short urls: {} expanded, {} from cache".format(
+            self.stats["expanded"], self.stats["cached"]))
+
+
+SHORT_URLS = ShortUrlResolver()
+
+
+class SQLiteCache(BaseCache):
+    """
+        CacheControl cache in a single SQLite file. When the responses take more than
+        max_size bytes the least recently used are evicted, a response larger than
+        max_size isn't stored. The responses stored more than ttl seconds ago are
+        treated as missing. The hits and misses are counted by the adapter, CacheControl
+        reads a key more than once per request.
+    """
+    def __init__(self, filepath, max_size=None, ttl=None):
+        self.filepath = filepath
+        self.max_size = max_size
+        self.ttl = ttl
+        self.conn = sqlite3.connect(filepath, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+                        "value BLOB, size INTEGER, stored REAL, accessed REAL, expires REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, stored, expires FROM responses WHERE key = ?",
+                                    (key,)).fetchone()
+            if row is not None and (self.ttl is not None and now - row[1] > self.ttl or\
+                row[2] is not None and now > row[2]):
+                self.remove(key)
+                self.conn.commit()
+                self.stats["expired"] += 1
+                row = None
+            if row is None:
+                return None
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.stats["bytes_read"] += len(row[0])
+            return row[0]
+
+    def set(self, key, value, expires=None):
+        now = time.time()
+        if expires is not None:
+            expires = now + expires
+        with self.lock:
+            self.remove(key)
+            if self.max_size is not None and len(value) > self.max_size:
+                #it would evict every response, itself included
+                self.stats["too_large"] += 1
+                self.conn.commit()
+                return
+            self.conn.execute("INSERT INTO responses (key, value, size, stored, accessed, expires) "
+                            "VALUES (?, ?, ?, ?, ?, ?)", (key, value, len(value), now, now, expires))
+            self.size += len(value)
+            self.stats["bytes_written"] += len(value)
+            self.evict(keep=key)
+            self.conn.commit()
+
+    def delete(self, key):
+        with self.lock:
+            self.remove(key)
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def remove(self, key):
+        row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.size -= row[0]
+
+    def evict(self, keep=None):
+        """
+            Removes the least recently used responses (but keep) until they take 90%
+            of max_size
+        """
+        if self.max_size is None or self.size <= self.max_size:
+            return
+        while self.size > self.max_size * .9:
+            rows = self.conn.execute("SELECT key, size FROM responses WHERE key IS NOT ? "
+                                    "ORDER BY accessed LIMIT 100", (keep,)).fetchall()
+            if len(rows) == 0:
+                break
+            for key, size in rows:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+                self.stats["evicted"] += 1
+                if self.size <= self.max_size * .9:
+                    break
+
+    def compact(self):
+        """
+            Removes the expired responses, evicts down to max_size and rebuilds the file
+        """
+        now = time.time()
+        with self.lock:
+            if self.ttl is not None:
+                self.conn.execute("DELETE FROM responses WHERE stored < ?", (now - self.ttl,))
+            self.conn.execute("DELETE FROM responses WHERE expires < ?", (now,))
+            self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self.evict()
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+
+    def count(self, hit):
+        with self.lock:
+            self.stats["hits" if hit else "misses"] += 1
+
+    def report(self):
+        LOGGER.info("Webcache: {} hits ({:.1f} MB), {} misses, {} expired, {} evicted, "
+                    "{} too large, {:.1f} MB written, {:.1f} MB stored".format(
+                    self.stats["hits"], self.stats["bytes_read"] / 2**20, self.stats["misses"],
+                    self.stats["expired"], self.stats["evicted"], self.stats["too_large"],
+                    self.stats["bytes_written"] / 2**20, self.size / 2**20))
+
+
+def mount_webcache(webcache):
+    """
+        Mounts new adapters on sess with webcache as the cache of both, the
+        requests that miss the cache go through SCHEDULER
+    """
+    global cache, basic_adapter, forever_adapter
+    cache = webcache
+    basic_adapter = ScheduledCacheControlAdapter(cache=cache)
+    forever_adapter = ScheduledCacheControlAdapter(heuristic=CacheForeverHeuristic(), cache=cache)
+    sess.mount('http://', basic_adapter)
+    sess.mount('https://', basic_adapter)
+    sess.mount(BASE_URL, forever_adapter)
+
+
+def compact_webcache(argv):
+    parser = argparse.ArgumentParser(prog="sushichef.py compact-webcache",
+        description="Removes the expired responses of the SQLite webcache and shrinks the file")
+    parser.add_argument("--max-size", type=int, default=None, help="size cap in MB")
+    parser.add_argument("--ttl", type=int, default=None, help="days a response is kept")
+    args = parser.parse_args(argv)
+    webcache = SQLiteCache(WEBCACHE_DB,
+        max_size=args.max_size * 2**20 if args.max_size is not None else None,
+        ttl=args.ttl * 24 * 60 * 60 if args.ttl is not None else None)
+    size = os.path.getsize(WEBCACHE_DB)
+    webcache.compact()
+    webcache.report()
+    LOGGER.info("{}: {:.1f} MB -> {:.1f} MB".format(WEBCACHE_DB, size / 2**20,
+        os.path.getsize(WEBCACHE_DB) / 2**20))
+    webcache.close()
+
+
+class HttpArchive(object):
+    """
+        Http responses in an append-only data file (it's not WARC), each record is a
+        json header line followed by the zlib compressed body. The index file has the
+        offset of every record by request. The responses of a request are replayed in
+        the order they were recorded, the last one is repeated.
+    """
+    def __init__(self, path, mode="record"):
+        self.mode = mode
+        self.data_filepath = path + ".dat"
+        self.index_filepath = path + ".idx"
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        #request key -> [(offset, length)], and the next record to replay
+        self.index = defaultdict(list)
+        self.replayed = Counter()
+        if mode == "record":
+            build_path([os.path.dirname(path) or "."])
+            self.data_file = open(self.data_filepath, "wb")
+            self.index_file = open(self.index_filepath, "w")
+        else:
+            self.data_file = open(self.data_filepath, "rb")
+            with open(self.index_filepath) as f:
+                for line in f:
+                    key, offset, length = json.loads(line)
+                    self.index[key].append((offset, length))
+
+    @staticmethod
+    def key(request):
+        key = "{} {}".format(request.method, request.url)
+        if request.headers.get("If-None-Match"):
+            key += " If-None-Match:" + request.headers["If-None-Match"]
+        if request.body:
+            body = request.body if isinstance(request.body, bytes) else request.body.encode("utf-8")
+            key += " " + hashlib.sha1(body).hexdigest()
+        return key
+
+    def record(self, key, response):
+        """
+            Records response with the request key while its body is consumed: the
+            chunks yielded by iter_content (response.content reads them too) are
+            compressed to a temporary file and the record is appended when the body
+            is complete. Closing the response reads the rest of the body, a 304 or an
+            error response that isn't read is recorded too.
+        """
+        header = dict(url=response.url, status=response.status_code, reason=response.reason,
+                    headers=dict(response.headers))
+        iter_content = response.iter_content
+        close = response.close
+        #the temporary body is shared by the iterations, the body is read once
+        state = dict(body=None, compressor=None, recorded=False)
+
+        def iter_bytes(chunk_size):
+            if state["recorded"]:
+                yield from iter_content(chunk_size=chunk_size)
+                return
+            if state["body"] is None:
+                state["body"] = tempfile.TemporaryFile()
+                state["compressor"] = zlib.compressobj()
+            for chunk in iter_content(chunk_size=chunk_size):
+                state["body"].write(state["compressor"].compress(chunk))
+                yield chunk
+            state["body"].write(state["compressor"].flush())
+            state["recorded"] = True
+            with state["body"] as body:
+                self.append(key, header, body)
+
+        def recording_iter_content(chunk_size=1, decode_unicode=False):
+            chunks = iter_bytes(chunk_size)
+            if decode_unicode:
+                chunks = requests.utils.stream_decode_response_unicode(chunks, response)
+            return chunks
+
+        def recording_close():
+            if not state["recorded"]:
+                try:
+                    for _chunk in iter_bytes(ASSETS_CHUNK_SIZE):
+                        pass
+                except requests.exceptions.RequestException as e:
+                    LOGGER.info("The response can't be archived: {} {}".format(key, e))
+            close()
+
+        response.iter_content = recording_iter_content
+        response.close = recording_close
+
+    def append(self, key, header, body):
+        header = json.dumps(header).encode("utf-8") + b"\n"
+        body.seek(0)
+        with self.lock:
+            offset = self.data_file.tell()
+            self.data_file.write(header)
+            shutil.copyfileobj(body, self.data_file)
+            length = self.data_file.tell() - offset
+            self.data_file.flush()
+            self.index_file.write(json.dumps([key, offset, length]) + "\n")
+            self.index_file.flush()
+            self.stats["recorded"] += 1
+            self.stats["bytes"] += length
+
+    def replay(self, request):
+        key = self.key(request)
+        with self.lock:
+            records = self.index.get(key)
+            if not records:
+                self.stats["missing"] += 1
+                raise requests.exceptions.ConnectionError("Not in the archive: {}".format(key),
+                                                        request=request)
+            offset, length = records[min(self.replayed[key], len(records) - 1)]
+            self.replayed[key] += 1
+            self.data_file.seek(offset)
+            record = self.data_file.read(length)
+            self.stats["replayed"] += 1
+        header, body = record.split(b"\n", 1)
+        header = json.loads(header.decode("utf-8"))
+        response = requests.Response()
+        response.status_code = header["status"]
+        response.reason = header["reason"]
+        response.headers = requests.structures.CaseInsensitiveDict(header["headers"])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = header["url"]
+        response.request = request
+        response._content = zlib.decompress(body)
+        response._content_consumed = True
+        return response
+
+    def report(self):
+        LOGGER.info("Http archive ({}): {} recorded ({:.1f} MB), {} replayed, {} missing".format(
+            self.mode, self.stats["recorded"], self.stats["bytes"] / 2**20,
+            self.stats["replayed"], self.stats["missing"]))
+
+
+class ArchiveAdapter(requests.adapters.BaseAdapter):
+    """
+        Records the responses of adapter in the archive, or replays them without
+        calling it
+    """
+    def __init__(self, adapter, archive):
+        super(ArchiveAdapter, self).__init__()
+        self.adapter = adapter
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        if self.archive.mode == "replay":
+            response = self.archive.replay(request)
+            response.connection = self
+            return response
+        #the key is built before the adapters add their headers (the conditional
+        #headers of the webcache), like in replay
+        key = self.archive.key(request)
+        response = self.adapter.send(request, **kwargs)
+        self.archive.record(key, response)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+def archive_session(session):
+    """
+        Wraps the adapters of session with ArchiveAdapter when there is an archive
+    """
+    if ARCHIVE is not None:
+        for prefix, adapter in list(session.adapters.items()):
+            if not isinstance(adapter, ArchiveAdapter):
+                session.adapters[prefix] = ArchiveAdapter(adapter, ARCHIVE)
+    return session
+
+
+class HostState(object):
+    """
+        Token bucket and AIMD concurrency limit of a host. The limit grows by one
+        per window of fast responses and is halved by a throttled (429), failed
+        (5xx, connection error) or slow response.
+    """
+    def __init__(self, rate=None, concurrency=4, max_concurrency=16, slow=5):
+        self.rate = rate
+        #a rate below 1 still needs room for a whole token
+        self.capacity = max(1., rate) if rate else None
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.limit = float(concurrency)
+        self.max_limit = max_concurrency
+        self.slow = slow
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+            Waits for a token and a free slot, returns the time waited
+        """
+        start = time.time()
+        with self.condition:
+            while True:
+                wait = None
+                if self.rate:
+                    now = time.time()
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens < 1:
+                        wait = (1 - self.tokens) / self.rate
+                if wait is None and self.in_flight < int(self.limit):
+                    if self.rate:
+                        self.tokens -= 1
+                    self.in_flight += 1
+                    return time.time() - start
+                self.condition.wait(wait)
+
+    def release(self, latency, congested=False):
+        with self.condition:
+            self.in_flight -= 1
+            if congested or latency > self.slow:
+                self.limit = max(1., self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1. / self.limit)
+            self.condition.notify_all()
+
+
+class RequestScheduler(object):
+    """
+        Every request that goes to the network passes through the state of its host.
+        The 429 and 5xx responses and the connection errors of idempotent requests
+        are retried with exponential backoff and jitter (or the Retry-After delay).
+    """
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, rate=None, concurrency=4, max_concurrency=16, tries=4, base=.5,
+                max_delay=60):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.tries = tries
+        self.base = base
+        self.max_delay = max_delay
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.stats = defaultdict(Counter)
+
+    def host(self, url):
+        host = urlparse(url).netloc or url
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostState(rate=self.rate, concurrency=self.concurrency,
+                                            max_concurrency=self.max_concurrency)
+        return host, self.hosts[host]
+
+    def send(self, send, request, *args, **kwargs):
+        host, state = self.host(request.url)
+        retryable = request.method in RequestScheduler.IDEMPOTENT_METHODS
+        for attempt in range(self.tries):
+            waited = state.acquire()
+            try:
+                response = self.send_once(state, send, request, *args, **kwargs)
+            except requests.exceptions.ConnectionError:
+                self.count(host, waited, errors=1)
+                if not retryable or attempt + 1 >= self.tries:
+                    raise
+                self.backoff(request.url, attempt)
+                continue
+            congested = response.status_code in RequestScheduler.RETRY_STATUS
+            self.count(host, waited, errors=int(congested))
+            if not congested or not retryable or attempt + 1 >= self.tries:
+                return response
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            self.backoff(request.url, attempt,
+                        retry_after=int(retry_after) if retry_after and retry_after.isdigit() else None)
+
+    def send_once(self, state, send, request, *args, **kwargs):
+        """
+            Sends the request on an acquired slot of state, the slot is released
+            whatever the adapter returns or raises
+        """
+        start = time.time()
+        congested = True
+        try:
+            response = send(request, *args, **kwargs)
+            congested = response.status_code in RequestScheduler.RETRY_STATUS
+            return response
+        finally:
+            state.release(time.time() - start, congested=congested)
+
+    def count(self, host, waited, errors=0):
+        with self.lock:
+            self.stats[host]["requests"] += 1
+            self.stats[host]["errors"] += errors
+            self.stats[host]["waited"] += waited
+
+    def delay(self, url, attempt, retry_after=None):
+        """
+            Returns the time to wait before the retry attempt + 1 of url
+        """
+        if retry_after is not None:
+            delay = min(retry_after, self.max_delay)
+        else:
+            delay = min(self.max_delay, self.base * 2 ** attempt)
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        host = urlparse(url).netloc or url
+        with self.lock:
+            self.stats[host]["retries"] += 1
+            self.stats[host]["backoff"] += delay
+        return delay
+
+    def backoff(self, url, attempt, retry_after=None):
+        time.sleep(self.delay(url, attempt, retry_after=retry_after))
+
+    def report(self):
+        with self.lock:
+            for host, stats in sorted(self.stats.items()):
+                state = self.hosts.get(host)
+                LOGGER.info("Host {}: {} requests, {} errors, {} retries, {:.1f}s backoff, "
+                            "{:.1f}s throttled, concurrency {}".format(host, stats["requests"],
+                            stats["errors"], stats["retries"], stats["backoff"], stats["waited"],
+                            int(state.limit) if state is not None else "-"))
+
+
+SCHEDULER = RequestScheduler()
+
+
+class ScheduledAdapter(requests.adapters.HTTPAdapter):
+    """
+        HTTPAdapter that sends the requests through SCHEDULER, using the connection
+        pools of TRANSPORT
+    """
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = TRANSPORT.poolmanager
+
+    def send(self, request, *args, **kwargs):
+        #CacheControlAdapter >= 0.13 passes stream, timeout, etc. as positional arguments
+        return SCHEDULER.send(super(ScheduledAdapter, self).send, request, *args, **kwargs)
+
+    def close(self):
+        #the pools are shared with the other adapters
+        pass
+
+
+class ScheduledCacheControlAdapter(CacheControlAdapter, ScheduledAdapter):
+    """
+        CacheControlAdapter that sends the requests that miss the cache through SCHEDULER
+    """
+    def send(self, request, **kwargs):
+        response = super(ScheduledCacheControlAdapter, self).send(request, **kwargs)
+        if isinstance(self.cache, SQLiteCache) and request.method in self.cacheable_methods:
+            #a revalidated response (304) is a hit too
+            self.cache.count(getattr(response, "from_cache", False))
+        return response
+
+
+class Transport(object):
+    """
+        The connection pools of every session of the chef, the connections to a host
+        are kept alive and reused by all the adapters. Up to pool_size connections
+        are kept for each host.
+    """
+    def __init__(self, pool_size=10, num_pools=100):
+        self.pool_size = pool_size
+        self.poolmanager = urllib3.PoolManager(num_pools=num_pools, maxsize=pool_size)
+        self.poolmanager.pools.dispose_func = self.dispose
+        self.lock = threading.Lock()
+        #connections and requests of the pools already closed by host
+        self.stats = defaultdict(Counter)
+
+    def session(self):
+        """
+            Returns a session without cache, its requests are scheduled and
+            use the shared pools
+        """
+        session = requests.Session()
+        session.headers.update(downloader.DOWNLOAD_SESSION.headers)
+        for prefix in ("http://", "https://"):
+            session.mount(prefix, ScheduledAdapter())
+        return archive_session(session)
+
+    def dispose(self, pool):
+        with self.lock:
+            self.stats[pool.host]["connections"] += pool.num_connections
+            self.stats[pool.host]["requests"] += pool.num_requests
+        pool.close()
+
+    def report(self):
+        with self.lock:
+            stats = defaultdict(Counter, {host: Counter(counter) for host, counter in self.stats.items()})
+        for key in self.poolmanager.pools.keys():
+            pool = self.poolmanager.pools.get(key)
+            if pool is not None:
+                stats[pool.host]["connections"] += pool.num_connections
+                stats[pool.host]["requests"] += pool.num_requests
+        for host, counter in sorted(stats.items()):
+            if counter["requests"] > 0:
+                LOGGER.info("Connections {}: {} requests over {} connections, {:.0%} reused".format(
+                    host, counter["requests"], counter["connections"],
+                    1 - float(counter["connections"]) / counter["requests"]))
+
+
+TRANSPORT = Transport()
+
+
+class JsonStore(object):
+    """
+        Keyed values persisted in a json file, entries older than ttl seconds
+        are treated as missing.
+    """
+    def __init__(self, filepath, ttl=None):
+        self.filepath = filepath
+        self.ttl = ttl
+        try:
+            with open(filepath, 'r') as f:
+                self.data = json.load(f)
+        except (IOError, ValueError):
+            self.data = {}
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None or (self.ttl is not None and time.time() - entry["time"] > self.ttl):
+            return default
+        return entry["value"]
+
+    def set(self, key, value):
+        self.data[key] = {"time": time.time(), "value": value}
+
+    def save(self):
+        build_path([os.path.dirname(self.filepath) or "."])
+        tmp_filepath = self.filepath + ".tmp"
+        with open(tmp_filepath, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_filepath, self.filepath)
+
+
+class ZipBuilder(object):
+    """
+        Collects the entries of an html5 zip (index, pages, css, js and images) and
+        writes the zip in one pass when it's closed, appending them one by one
+        rewrites the zip's central directory on every open. As HTMLWriter, the first
+        entry added to a path is the one written.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.entries = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+
+    def add(self, filename, directory, method, *args):
+        if directory:
+            path = "{}/{}".format(directory.rstrip("/"), filename)
+        else:
+            path = filename
+        if path not in self.entries:
+            self.entries[path] = (method, args)
+
+    def write_index_contents(self, content):
+        self.add("index.html", None, "write_index_contents", content)
+
+    def write_contents(self, filename, content, directory=None):
+        self.add(filename, directory, "write_contents", filename, content, directory)
+
+    def write_url(self, url, filename, directory=None):
+        self.add(filename, directory, "write_url", url, filename, directory)
+
+    def close(self):
+        with html_writer.HTMLWriter(self.filepath, "w") as zipper:
+            for method, args in self.entries.values():
+                if method == "write_url":
+                    #the downloads are shared by all the zips
+                    url, filename, directory = args
+                    zipper.write_contents(filename, ASSETS.read(url), directory=directory)
+                else:
+                    getattr(zipper, method)(*args)
+
+
+class AssetStore(object):
+    """
+        Images and pdfs downloaded once per run. The files are streamed to disk and
+        stored by the md5 of their content, so an asset published under several urls
+        is stored once. The files from previous runs are revalidated with the ETag
+        (or the size when there isn't an ETag) instead of being downloaded again.
+    """
+    def __init__(self, directory, workers=4):
+        self.directory = directory
+        self.workers = workers
+        self.index = JsonStore(os.path.join(directory, "index.json"))
+        #the downloads are streamed, they don't go through the webcache
+        self.session = TRANSPORT.session()
+        self.downloads = threading.BoundedSemaphore(workers)
+        self.urls = {}
+        #locks by url and by stored file
+        self.locks = defaultdict(threading.Lock)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def get(self, url):
+        """
+            Returns the filepath of the content of url, it's fetched the first
+            time the url is requested in this run
+        """
+        with self.lock:
+            url_lock = self.locks[url]
+        with url_lock:
+            entry = self.urls.get(url)
+            if entry is not None:
+                with self.lock:
+                    self.stats["requests_saved"] += 1
+                    self.stats["bytes_saved"] += entry["size"]
+                return entry["filepath"]
+            with self.downloads:
+                entry = self.fetch(url)
+            self.urls[url] = entry
+            return entry["filepath"]
+
+    def fetch(self, url):
+        with self.lock:
+            entry = self.index.get(url)
+        headers = {}
+        if entry is not None and os.path.exists(entry["filepath"]):
+            if entry["etag"] is not None:
+                headers["If-None-Match"] = entry["etag"]
+            else:
+                response = self.session.head(url, allow_redirects=True)
+                if response.ok and response.headers.get("Content-Length") == str(entry["size"]):
+                    return self.revalidated(entry)
+
+        with self.session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                return self.revalidated(entry)
+            response.raise_for_status()
+            entry = self.stream(url, response)
+        with self.lock:
+            self.index.set(url, entry)
+        return entry
+
+    def revalidated(self, entry):
+        with self.lock:
+            self.stats["revalidated"] += 1
+            self.stats["bytes_saved"] += entry["size"]
+        return entry
+
+    def stream(self, url, response):
+        """
+            Writes the body to a temporary file computing its md5, the file is
+            renamed to its content address when it's complete
+        """
+        md5 = hashlib.md5()
+        size = 0
+        f = tempfile.NamedTemporaryFile(dir=build_path([self.directory]), suffix=".tmp",
+                                        delete=False)
+        try:
+            with f:
+                for chunk in response.iter_content(chunk_size=ASSETS_CHUNK_SIZE):
+                    f.write(chunk)
+                    md5.update(chunk)
+                    size += len(chunk)
+            digest = md5.hexdigest()
+            ext = os.path.splitext(urlparse(url).path)[1]
+            filepath = os.path.join(build_path([self.directory, digest[:2]]), digest + ext.lower())
+            with self.lock:
+                file_lock = self.locks[filepath]
+            with file_lock:
+                if os.path.exists(filepath):
+                    os.remove(f.name)
+                    with self.lock:
+                        self.stats["duplicates"] += 1
+                else:
+                    os.replace(f.name, filepath)
+        except BaseException:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+            raise
+        with self.lock:
+            self.stats["downloads"] += 1
+            self.stats["bytes_downloaded"] += size
+        return dict(filepath=filepath, md5=digest, size=size, etag=response.headers.get("ETag"))
+
+    def read(self, url):
+        with open(self.get(url), 'rb') as f:
+            return f.read()
+
+    def link(self, url, filepath):
+        """
+            Hardlinks the content of url to filepath, it's copied if the filesystem
+            doesn't support hardlinks
+        """
+        asset_filepath = self.get(url)
+        if os.path.exists(filepath):
+            if os.path.samefile(asset_filepath, filepath):
+                return filepath
+            os.remove(filepath)
+        try:
+            os.link(asset_filepath, filepath)
+        except OSError:
+            shutil.copyfile(asset_filepath, filepath)
+        return filepath
+
+    def save(self):
+        with self.lock:
+            self.index.save()
+
+    def report(self):
+        LOGGER.info("Assets: {} downloads ({:.1f} MB), {} duplicated contents, {} revalidated, "
+                    "{} requests saved, {:.1f} MB not downloaded".format(
+                    self.stats["downloads"], self.stats["bytes_downloaded"] / 2**20,
+                    self.stats["duplicates"], self.stats["revalidated"],
+                    self.stats["requests_saved"], self.stats["bytes_saved"] / 2**20))
+
+
+ASSETS = AssetStore(ASSETS_DIR)
+
+
+class ExtractionStore(object):
+    """
+        Extraction records by url in a SQLite file, a record is valid while the
+        page body, EXTRACTION_VERSION and the parse options are the same.
+    """
+    def __init__(self, filepath, version=EXTRACTION_VERSION):
+        build_path([os.path.dirname(filepath) or "."])
+        self.version = version
+        self.conn = sqlite3.connect(filepath, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS extractions "
+                        "(url TEXT PRIMARY KEY, key TEXT, record TEXT)")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def key(self, document):
+        if isinstance(document, str):
+            document = document.encode("utf-8")
+        digest = hashlib.sha1(document)
+        digest.update("{}:{}:{}".format(self.version, HTML_PARSER, STRAINED_PARSE).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, url, document):
+        key = self.key(document)
+        with self.lock:
+            row = self.conn.execute("SELECT key, record FROM extractions WHERE url = ?",
+                                    (url,)).fetchone()
+            if row is None or row[0] != key:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+        return json.loads(row[1])
+
+    def set(self, url, document, record):
+        key = self.key(document)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO extractions (url, key, record) VALUES (?, ?, ?)",
+                            (url, key, json.dumps(record)))
+            self.conn.commit()
+
+    def report(self):
+        LOGGER.info("Extraction cache: {} hits, {} misses".format(
+            self.stats["hits"], self.stats["misses"]))
 
 
 def build_path(levels):
     path = os.path.join(*levels)
     if not if_dir_exists(path):
-        os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
     return path
 
 
@@ -1291,7 +3047,7 @@ class LivingLabs(Collection):
             section["resources"] = files_info
 
         info = self.info(descriptions[0], sections)
-        videos_info = all_sections.build_videos_info(base_path, self.license)        
+        videos_info = all_sections.build_videos_info(self.license)
         if videos_info is not None:
             info["children"] += videos_info
         return info
@@ -1389,7 +3145,7 @@ class LivingLabsSection(CollectionSection):
             source_id=self.collection.source_id)
         img = ImagesListResource(self.get_imgs_into_links(), filepath=img_filepath, 
             title=self.collection.title)
-        videos_info = self.build_videos_info(self.base_path, self.license)
+        videos_info = self.build_videos_info(self.license)
         info = [self.info()]
         if videos_info is not None:
             info += videos_info
@@ -1416,22 +3172,20 @@ class LivingLabsSection(CollectionSection):
                 ]
             )
     
-    def write_css_js(self, filepath):
-        with html_writer.HTMLWriter(filepath, "a") as zipper, open("chefdata/styles.css") as f:
+    def write_css_js(self, zipper):
+        with open("chefdata/styles.css") as f:
             content = f.read()
             zipper.write_contents("styles.css", content, directory="css/")
 
-        with html_writer.HTMLWriter(filepath, "a") as zipper, open("chefdata/scripts.js") as f:
+        with open("chefdata/scripts.js") as f:
             content = f.read()
             zipper.write_contents("scripts.js", content, directory="js/")
 
-    def write_img(self, url, filename):
-        with html_writer.HTMLWriter(self.filename, "a") as zipper:
-            zipper.write_url(url, filename, directory="files")
+    def write_img(self, zipper, url, filename):
+        zipper.write_url(url, filename, directory="files")
 
-    def write(self, content):
-        with html_writer.HTMLWriter(self.filename, "w") as zipper:
-            zipper.write_index_contents(content)
+    def write(self, zipper, content):
+        zipper.write_index_contents(content)
 
     def to_file(self):
         if self.body is not None:
@@ -1439,10 +3193,11 @@ class LivingLabsSection(CollectionSection):
             content = self.get_content()
             html = '<html><head><meta charset="utf-8"><link rel="stylesheet" href="css/styles.css"></head><body><div class="main-content-with-sidebar">{}</div></body></html>'.format(
                 content)
-            self.write(html)
-            self.write_css_js(self.filename)
-            for img_src, img_filename in images:
-                self.write_img(img_src, img_filename)
+            with ZipBuilder(self.filename) as zipper:
+                self.write(zipper, html)
+                self.write_css_js(zipper)
+                for img_src, img_filename in images:
+                    self.write_img(zipper, img_src, img_filename)
 
 
 def attach_curriculums_from_urls(links, channel_tree):
@@ -1468,6 +3223,29 @@ def attach_curriculums_from_urls(links, channel_tree):
             ) 
 
 
+def remember(items, memory):
+    """
+        Yields the items and appends each one to the list memory
+    """
+    for item in items:
+        memory.append(item)
+        yield item
+
+
+def iter_queue(items_queue):
+    """
+        Yields the items put in the queue until None, an exception put in the
+        queue is raised.
+    """
+    while True:
+        item = items_queue.get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
 def save_thumbnail():
     url = "https://scontent.xx.fbcdn.net/v/t1.0-1/p50x50/10492197_815509258473514_3497726003055575270_n.jpg?oh=bfcd61aebdb3d2265c31c2286290bd31&oe=5B1FACCA"
     THUMB_DATA_DIR = build_path([DATA_DIR, 'thumbnail'])
@@ -1483,75 +3261,201 @@ class TeachEngineeringChef(JsonTreeChef):
     HOSTNAME = "teachengineering.org"
     TREES_DATA_DIR = os.path.join(DATA_DIR, 'trees')
     CRAWLING_STAGE_OUTPUT_TPL = 'web_resource_tree_{}.json'
+    CRAWLING_STAGE_JSONL_TPL = 'web_resource_tree_{}.jsonl'
     SCRAPING_STAGE_OUTPUT_TPL = 'ricecooker_json_tree_{}.json'
+    # subject areas of the english resources, the spanish run reads them from here
+    SUBJECTS_AREA_STORE = os.path.join(TREES_DATA_DIR, 'subjects_area.json')
     LICENSE = get_license(licenses.CC_BY, copyright_holder="The source of this material is the TeachEngineering digital library collection at www.TeachEngineering.org. All rights reserved.").as_dict()
     #THUMBNAIL = 'https://www.teachengineering.org/images/logos/v-636511398960000000/TELogoNew.png'
 
     def __init__(self):
         build_path([TeachEngineeringChef.TREES_DATA_DIR])
         self.thumbnail = save_thumbnail()
+        self.prepared = False
         super(TeachEngineeringChef, self).__init__()
 
+    def run(self, args, options):
+        """
+            With lang=all the crawl and the scrape of both languages run once in
+            pre_run, then each channel is uploaded.
+        """
+        if options.get('lang', 'en') != 'all':
+            return super(TeachEngineeringChef, self).run(args, options)
+
+        self.pre_run(args, options)
+        self.prepared = True
+        for lang in LANGUAGES:
+            super(TeachEngineeringChef, self).run(args, dict(options, lang=lang))
+
     def download_css_js(self):
-        r = requests.get("https://raw.githubusercontent.com/learningequality/html-app-starter/master/css/styles.css")
+        r = sess.get("https://raw.githubusercontent.com/learningequality/html-app-starter/master/css/styles.css")
         with open("chefdata/styles.css", "wb") as f:
             f.write(r.content)
 
-        r = requests.get("https://raw.githubusercontent.com/learningequality/html-app-starter/master/js/scripts.js")
+        r = sess.get("https://raw.githubusercontent.com/learningequality/html-app-starter/master/js/scripts.js")
         with open("chefdata/scripts.js", "wb") as f:
             f.write(r.content)
 
     def pre_run(self, args, options):
+        if self.prepared:
+            return
+        global HTML_PARSER, STRAINED_PARSE, EXTRACTIONS, ASSETS, VIDEOS_INFO, VIDEOS, SHORT_URLS
+        global ARCHIVE, SCHEDULER, TRANSPORT
+        HTML_PARSER = options.get('parser', HTML_PARSER)
+        STRAINED_PARSE = int(options.get('strained', 0)) == 1
+        TRANSPORT = Transport(pool_size=int(options.get('pool_size', 10)))
+        rate = float(options.get('host_rate', 0))
+        SCHEDULER = RequestScheduler(rate=rate if rate > 0 else None,
+                                    concurrency=int(options.get('host_concurrency', 4)),
+                                    max_concurrency=int(options.get('host_max_concurrency', 16)))
+        if options.get('webcache', 'file') == 'sqlite':
+            max_size = int(options.get('webcache_max_size', 0))
+            ttl = int(options.get('webcache_ttl', 0))
+            mount_webcache(SQLiteCache(WEBCACHE_DB,
+                max_size=max_size * 2**20 if max_size > 0 else None,
+                ttl=ttl * 24 * 60 * 60 if ttl > 0 else None))
+        else:
+            mount_webcache(cache)
+        if options.get('archive') in ("record", "replay"):
+            ARCHIVE = HttpArchive(options.get('archive_path', ARCHIVE_PATH),
+                                mode=options['archive'])
+            archive_session(sess)
+            archive_session(downloader.DOWNLOAD_SESSION)
+        if int(options.get('extractions', 1)) == 1:
+            EXTRACTIONS = ExtractionStore(EXTRACTIONS_DB)
+        ASSETS = AssetStore(ASSETS_DIR, workers=int(options.get('asset_workers', 4)))
+        VIDEOS_INFO = JsonStore(VIDEOS_INFO_CACHE)
+        SHORT_URLS = ShortUrlResolver(JsonStore(SHORT_URLS_CACHE, ttl=SHORT_URLS_TTL),
+                                    workers=int(options.get('short_url_workers', 8)))
+        VIDEOS = VideoPool(workers=int(options.get('video_workers', 2)),
+                        ratelimit=int(options.get('video_ratelimit', 0)),
+                        tries=int(options.get('video_tries', 3)))
         css = os.path.join(os.path.dirname(os.path.realpath(__file__)), "chefdata/styles.css")
         js = os.path.join(os.path.dirname(os.path.realpath(__file__)), "chefdata/scripts.js")
         if not if_file_exists(css) or not if_file_exists(js):
             LOGGER.info("Downloading styles")
             self.download_css_js()
-        self.crawl(args, options)
-        self.scrape(args, options)
+        if int(options.get('pipeline', 0)) == 1:
+            self.pipeline(args, options)
+        else:
+            self.crawl(args, options)
+            self.scrape(args, options)
         #test()
 
-    def crawl(self, args, options):
-        web_resource_tree = dict(
+    def pipeline(self, args, options):
+        """
+            The resources yielded by the crawler are scraped as soon as they arrive,
+            the crawler runs in its own thread and feeds a bounded queue.
+        """
+        resources_queue = queue.Queue(maxsize=int(options.get('pipeline_queue_size', 100)))
+
+        def producer():
+            try:
+                for data in self.crawl_resources(options, self.web_resource_tree()):
+                    resources_queue.put(data)
+            except Exception as e:
+                resources_queue.put(e)
+            else:
+                resources_queue.put(None)
+
+        crawler = threading.Thread(target=producer, daemon=True)
+        crawler.start()
+        self.scrape(args, options, resources=iter_queue(resources_queue))
+        crawler.join()
+
+    def web_resource_tree(self):
+        return dict(
             kind='TeachEngineeringResourceTree',
             title='TeachEngineering',
             children=[]
         )
+
+    def crawl(self, args, options):
+        web_resource_tree = self.web_resource_tree()
+        for data in self.crawl_resources(options, web_resource_tree):
+            pass
+        return web_resource_tree
+
+    def crawl_resources(self, options, web_resource_tree):
+        """
+            Yields the crawled resources, each one is appended to web_resource_tree
+            and to the jsonl file as soon as it is crawled. The json file is written
+            when the crawling finishes.
+        """
         lang = options.get('lang', 'en')
         crawling_stage = os.path.join(TeachEngineeringChef.TREES_DATA_DIR,                     
                                     TeachEngineeringChef.CRAWLING_STAGE_OUTPUT_TPL.format(lang))
+        crawling_stage_jsonl = os.path.join(TeachEngineeringChef.TREES_DATA_DIR,
+                                    TeachEngineeringChef.CRAWLING_STAGE_JSONL_TPL.format(lang))
         curriculum_url = urljoin(TeachEngineeringChef.ROOT_URL.format(HOSTNAME=TeachEngineeringChef.HOSTNAME), "curriculum/browse")
+        page_size = int(options.get('crawl_page_size', 50))
+        concurrency = int(options.get('crawl_concurrency', 4))
         resource_browser = ResourceBrowser(curriculum_url)
-        for data in resource_browser.run():
-            web_resource_tree["children"].append(data)
+        with open(crawling_stage_jsonl, 'w') as f:
+            for data in resource_browser.run(page_size=page_size, concurrency=concurrency):
+                f.write(json.dumps(data) + "\n")
+                f.flush()
+                web_resource_tree["children"].append(data)
+                yield data
         with open(crawling_stage, 'w') as f:
             json.dump(web_resource_tree, f, indent=2)
-        return web_resource_tree
 
-    def scrape(self, args, options):
+    def scrape(self, args, options, resources=None):
         lang = options.get('lang', 'en')
         download_video = options.get('--download-video', "1")
         if int(download_video) == 0:
             global DOWNLOAD_VIDEOS
             DOWNLOAD_VIDEOS = False
 
-        crawling_stage = os.path.join(TeachEngineeringChef.TREES_DATA_DIR, 
-                                TeachEngineeringChef.CRAWLING_STAGE_OUTPUT_TPL.format(lang))
-        with open(crawling_stage, 'r') as f:
-            web_resource_tree = json.load(f)
-            assert web_resource_tree['kind'] == 'TeachEngineeringResourceTree'
-         
-        translation = gettext.translation('subjects', 'lang/', languages=[lang])
-        translation.install()
-        global _ 
-        _ = translation.gettext
-
-        if lang == 'es':
-            channel_tree = self._build_scraping_json_tree_es(web_resource_tree)
+        self.workers = int(options.get('workers', 1))
+        self.prefetch_window = int(options.get('prefetch', 0))
+        self.fetch_per_host = int(options.get('fetch_per_host', 4))
+        if resources is None:
+            crawling_stage = os.path.join(TeachEngineeringChef.TREES_DATA_DIR, 
+                                    TeachEngineeringChef.CRAWLING_STAGE_OUTPUT_TPL.format(lang))
+            with open(crawling_stage, 'r') as f:
+                web_resource_tree = json.load(f)
+                assert web_resource_tree['kind'] == 'TeachEngineeringResourceTree'
+            resources = web_resource_tree["children"]
+
+        if lang == 'all':
+            #both trees are built from the same crawl, the resources consumed by 
+            #the first tree are kept for the next ones
+            langs = LANGUAGES
+            crawled = []
+            resources = remember(resources, crawled)
         else:
-            channel_tree = self._build_scraping_json_tree(web_resource_tree)
-        
-        self.write_tree_to_json(channel_tree, lang)
+            langs = [lang]
+
+        for tree_lang in langs:
+            translation = gettext.translation('subjects', 'lang/', languages=[tree_lang])
+            translation.install()
+            global _ 
+            _ = translation.gettext
+
+            if tree_lang == 'es':
+                channel_tree = self._build_scraping_json_tree_es(resources)
+            else:
+                channel_tree = self._build_scraping_json_tree(resources)
+            
+            VIDEOS.finalize(channel_tree)
+            self.write_tree_to_json(channel_tree, tree_lang)
+            ASSETS.save()
+            ASSETS.report()
+            if VIDEOS_INFO is not None:
+                VIDEOS_INFO.save()
+            SHORT_URLS.save()
+            SHORT_URLS.report()
+            if isinstance(cache, SQLiteCache):
+                cache.report()
+            if ARCHIVE is not None:
+                ARCHIVE.report()
+            SCHEDULER.report()
+            TRANSPORT.report()
+            if EXTRACTIONS is not None:
+                EXTRACTIONS.report()
+            if lang == 'all':
+                resources = crawled
 
     def write_tree_to_json(self, channel_tree, lang):
         scrape_stage = os.path.join(TeachEngineeringChef.TREES_DATA_DIR, 
@@ -1564,9 +3468,26 @@ class TeachEngineeringChef(JsonTreeChef):
                     TeachEngineeringChef.SCRAPING_STAGE_OUTPUT_TPL.format(lang))
         return json_tree_path
 
-    def _build_scraping_json_tree(self, web_resource_tree):
+    def prefetch(self, resources, keys):
+        """
+            Yields (resource, documents), the pages at resource[key] are fetched 
+            ahead by the async fetcher when the prefetch option is set.
+        """
+        if self.prefetch_window <= 0:
+            for resource in resources:
+                yield resource, {}
+            return
+
+        fetcher = PageFetcher(per_host=self.fetch_per_host)
+        try:
+            for item in fetcher.prefetch(resources, keys, window=self.prefetch_window):
+                yield item
+        finally:
+            fetcher.close()
+
+    def _build_scraping_json_tree(self, resources):
         LANG = 'en'
-        channel_tree = dict(
+        channel_tree = ChannelTree(
             source_domain=TeachEngineeringChef.HOSTNAME,
             source_id='teachengineering',
             title='TeachEngineering',
@@ -1576,20 +3497,30 @@ class TeachEngineeringChef(JsonTreeChef):
             children=[],
             license=TeachEngineeringChef.LICENSE,
         )
-        for resource in web_resource_tree["children"]:
-            collection = Collection(resource["url"],
+        def scrape_resource(item):
+            resource, documents = item
+            return scrape_collection(resource["url"],
                             source_id=resource["id"],
                             type=resource["collection"],
                             title=resource["title"],
-                            lang=LANG)
-            collection.to_file(channel_tree)
+                            lang=LANG,
+                            document=prefetched(documents, "url"))
+
+        subjects_store = JsonStore(TeachEngineeringChef.SUBJECTS_AREA_STORE)
+        items = self.prefetch(resources, ["url"])
+        for result in ordered_map(scrape_resource, items, workers=self.workers):
+            if result is not None:
+                attach_collection(channel_tree, result)
+                subjects_store.set(result["resource_url"], result["subjects_area"])
+        subjects_store.save()
+        resolve_curricular_units(channel_tree)
         living_labs = LivingLabs()
-        channel_tree["children"].append(living_labs.sections(channel_tree))
+        channel_tree.add_child(channel_tree, living_labs.sections(channel_tree))
         return channel_tree
 
-    def _build_scraping_json_tree_es(self, web_resource_tree):
+    def _build_scraping_json_tree_es(self, resources):
         LANG = 'es'
-        channel_tree = dict(
+        channel_tree = ChannelTree(
             source_domain=TeachEngineeringChef.HOSTNAME,
             source_id='teachengineering_es',
             title='TeachEngineering (es)',
@@ -1599,25 +3530,51 @@ class TeachEngineeringChef(JsonTreeChef):
             children=[],
             license=TeachEngineeringChef.LICENSE,
         )
-        for resource in web_resource_tree["children"]:
-            if resource["spanishVersionId"] is not None:
-                collection_en = Collection(resource["url"],
-                        source_id=resource["id"],
-                        type=resource["collection"],
-                        title=resource["title"])
-                
-                collection = Collection(resource["url_es"],
-                        source_id=resource["spanishVersionId"],
-                        type=resource["collection"],
-                        title=resource["title"],
-                        lang=LANG,
-                        subjects_area=collection_en.get_subjects_area())
-                collection.to_file(channel_tree)
+        subjects_store = JsonStore(TeachEngineeringChef.SUBJECTS_AREA_STORE)
+        stats = Counter()
+
+        def scrape_resource(item):
+            resource, documents = item
+            subjects_area = resource["subjects_area"]
+            if subjects_area is None:
+                #the english run hasn't stored the subject areas of this resource
+                document = download_document(resource["url"])
+                if document is False:
+                    stats["failed"] += 1
+                    subjects_area = []
+                else:
+                    subjects_area = get_subjects_area_from_document(document)
+            return scrape_collection(resource["url_es"],
+                    source_id=resource["spanishVersionId"],
+                    type=resource["collection"],
+                    title=resource["title"],
+                    lang=LANG,
+                    subjects_area=subjects_area,
+                    document=prefetched(documents, "url_es"))
+
+        def spanish_resources():
+            for resource in resources:
+                if resource["spanishVersionId"] is not None:
+                    subjects_area = subjects_store.get(resource["url"])
+                    stats["stored" if subjects_area is not None else "fetched"] += 1
+                    yield dict(resource, subjects_area=subjects_area)
+
+        items = self.prefetch(spanish_resources(), ["url_es"])
+        for result in ordered_map(scrape_resource, items, workers=self.workers):
+            if result is not None:
+                attach_collection(channel_tree, result)
+        resolve_curricular_units(channel_tree)
+        LOGGER.info("Subject areas read from {}: {} (english pages fetched and parsed: {}, "
+            "failed: {})".format(TeachEngineeringChef.SUBJECTS_AREA_STORE, stats["stored"],
+            stats["fetched"], stats["failed"]))
         return channel_tree
 
 
 # CLI: This code will run when `souschef.py` is called on the command line
 ################################################################################
 if __name__ == '__main__':
-    chef = TeachEngineeringChef()
-    chef.main()
+    if len(sys.argv) > 1 and sys.argv[1] == "compact-webcache":
+        compact_webcache(sys.argv[2:])
+    else:
+        chef = TeachEngineeringChef()
+        chef.main()